@@ -0,0 +1,89 @@
+"""
+Numeric kernels for face descriptor comparison.
+
+Uses Numba (listed under performance optimizations in requirements-advanced.txt)
+when it is installed and falls back to equivalent NumPy code otherwise, so
+callers never need to check which implementation is active.
+"""
+
+import math
+import numpy as np
+
+# dlib descriptors are always 128-d; a constant trip count lets LLVM fully unroll the inner loop
+DIM = 128
+# Below this many rows the call overhead of BLAS SGEMV outweighs its blocking
+SMALL_GALLERY_ROWS = 4096
+
+try:
+    from numba import njit
+    NUMBA_AVAILABLE = True
+except ImportError:  # pragma: no cover - optional dependency
+    NUMBA_AVAILABLE = False
+
+
+if NUMBA_AVAILABLE:
+    @njit(cache=True, fastmath=True)
+    def pair_stats(a, b):
+        """Return (euclidean distance, dot product, ||a||, ||b||) in one pass over both vectors."""
+        d2 = 0.0
+        dot = 0.0
+        na = 0.0
+        nb = 0.0
+        for i in range(a.shape[0]):
+            x = a[i]
+            y = b[i]
+            d = x - y
+            d2 += d * d
+            dot += x * y
+            na += x * x
+            nb += y * y
+        return math.sqrt(d2), dot, math.sqrt(na), math.sqrt(nb)
+
+    @njit(cache=True, fastmath=True, boundscheck=False)
+    def _score128(gallery, probe, out):
+        for i in range(gallery.shape[0]):
+            acc = np.float32(0.0)
+            for j in range(DIM):
+                acc += gallery[i, j] * probe[j]
+            out[i] = acc
+
+    @njit(cache=True, fastmath=True)
+    def dot_i8(codes, q):
+        """Return int32 dot products of each int8 row of ``codes`` with the int8 vector ``q``."""
+        n, d = codes.shape
+        out = np.empty(n, dtype=np.int32)
+        for i in range(n):
+            acc = np.int32(0)
+            for j in range(d):
+                acc += np.int32(codes[i, j]) * np.int32(q[j])
+            out[i] = acc
+        return out
+else:
+    def pair_stats(a, b):
+        """Return (euclidean distance, dot product, ||a||, ||b||) for two vectors."""
+        diff = a - b
+        return (float(np.sqrt(diff @ diff)), float(a @ b),
+                float(np.sqrt(a @ a)), float(np.sqrt(b @ b)))
+
+    def dot_i8(codes, q):
+        """Return int32 dot products of each int8 row of ``codes`` with the int8 vector ``q``."""
+        return codes.astype(np.int32) @ q.astype(np.int32)
+
+
+def gallery_dots(gallery: np.ndarray, probe: np.ndarray) -> np.ndarray:
+    """Return ``gallery @ probe``, using the fixed-128 Numba kernel for small float32 galleries."""
+    if (NUMBA_AVAILABLE and gallery.shape[0] < SMALL_GALLERY_ROWS and gallery.shape[1] == DIM
+            and gallery.dtype == np.float32 and probe.dtype == np.float32
+            and gallery.flags.c_contiguous and probe.flags.c_contiguous):
+        out = np.empty(gallery.shape[0], dtype=np.float32)
+        _score128(gallery, probe, out)
+        return out
+    return gallery @ probe
+
+
+def warmup() -> None:
+    """Compile (or load from cache) the kernels so the first request doesn't pay for it."""
+    probe = np.zeros(128, dtype=np.float32)
+    pair_stats(probe, probe)
+    gallery_dots(np.zeros((1, DIM), dtype=np.float32), probe)
+    dot_i8(np.zeros((1, 128), dtype=np.int8), np.zeros(128, dtype=np.int8))
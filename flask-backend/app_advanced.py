@@ -3,23 +3,57 @@ Advanced Flask Backend for FaceMatch using state-of-the-art face recognition
 Features industrial-level accuracy with deep learning models
 """
 
-from flask import Flask, request, jsonify
+from flask import Flask, Request, request, jsonify
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
+import io
 import os
 from dotenv import load_dotenv
 import logging
-from face_recognition_advanced import advanced_face_service
+import binascii
+import numpy as np
+from face_recognition_advanced import advanced_face_service, decode_descriptor, encode_descriptor
 from insightface_faiss_service import insightface_faiss_service
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 # Load environment variables
 load_dotenv()
 
+class ORJSONProvider(DefaultJSONProvider):
+    """Serve jsonify() and request.get_json() through orjson; large match/encoding payloads encode several times faster"""
+    option = (orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS) if orjson else 0
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default, option=self.option).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(orjson.dumps(obj, default=self.default, option=self.option), mimetype=self.mimetype)
+
+class InMemoryRequest(Request):
+    """Keep multipart uploads in memory; MAX_CONTENT_LENGTH already caps them, so spooling to a temp file is pure I/O"""
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return io.BytesIO()
+
 app = Flask(__name__)
+app.request_class = InMemoryRequest
+if orjson is not None:
+    app.json = ORJSONProvider(app)
 CORS(app)
+app.config['MAX_CONTENT_LENGTH'] = 10 * 1024 * 1024  # 10MB max file size
 
 # Configure logging
+# Per-request detail is logged at DEBUG so production workers skip formatting it
+DEBUG_MODE = os.getenv('FLASK_DEBUG') == '1'
 logging.basicConfig(
-    level=logging.INFO,
+    level=logging.DEBUG if DEBUG_MODE else logging.INFO,
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
 logger = logging.getLogger(__name__)
@@ -27,6 +61,50 @@ logger = logging.getLogger(__name__)
 # Initialize advanced face recognition service
 face_service = advanced_face_service
 
+# Descriptors may travel as base64 little-endian float32 instead of JSON float lists
+DESCRIPTOR_MIMETYPE = 'application/x-descriptor-f32'
+DESCRIPTOR_ERRORS = (binascii.Error, ValueError, TypeError)
+
+def parse_descriptor(value, name='descriptor'):
+    """Convert a descriptor (float list or base64 float32) once into the contiguous float32 vector the service uses"""
+    try:
+        descriptor = np.ascontiguousarray(decode_descriptor(value))
+    except DESCRIPTOR_ERRORS:
+        raise ValueError(f'Invalid {name}: expected 128 floats or base64-encoded float32')
+    if descriptor.shape != (128,):
+        raise ValueError(f'Invalid {name}: expected 128 dimensions, got {descriptor.size}')
+    if not np.isfinite(descriptor).all():
+        raise ValueError(f'Invalid {name}: contains non-finite values')
+    return descriptor
+
+# FACEMATCH_STATELESS=1 runs several worker processes (gunicorn.conf.py); event indices are
+# per process there, so the endpoints that keep them are refused instead of answering partially
+EVENT_STATE_ENABLED = os.getenv('FACEMATCH_STATELESS') != '1'
+
+def event_state_disabled():
+    return jsonify({
+        'success': False,
+        'message': 'Event indexing is disabled on this multi-worker deployment (FACEMATCH_STATELESS=1)'
+    }), 409
+
+def parse_top_k(value, default=None):
+    """Result limit from the request: absent/null gives default, otherwise a positive integer"""
+    if value is None:
+        return default
+    if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+        raise ValueError('Invalid top_k: expected a positive integer')
+    try:
+        top_k = int(value)
+    except (ValueError, OverflowError):
+        raise ValueError('Invalid top_k: expected a positive integer')
+    if top_k < 1 or (isinstance(value, float) and value != top_k):
+        raise ValueError('Invalid top_k: expected a positive integer')
+    return top_k
+
+def wants_binary_descriptors():
+    """Clients opt into base64 float32 descriptors with Accept: application/x-descriptor-f32"""
+    return DESCRIPTOR_MIMETYPE in request.headers.get('Accept', '')
+
 @app.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
@@ -58,13 +136,27 @@ def analyze_face():
                 'message': 'No image file selected'
             }), 400
         
-        # Reset file pointer to beginning
-        image_file.seek(0)
+        logger.debug("🔍 Analyzing uploaded image: %s", image_file.filename)
         
-        logger.info(f"🔍 Analyzing uploaded image: {image_file.filename}")
+        # Decode in the request thread so the batched model only sees RGB arrays
+        image_rgb = face_service.decode_image(image_file.read())
+        if image_rgb is None:
+            return jsonify({
+                'success': False,
+                'message': 'Could not decode image file'
+            }), 400
         
         # Get high-quality face descriptor using advanced AI
-        descriptor = face_service.get_face_descriptor(image_file)
+        descriptor = face_service.get_face_descriptor(image_rgb)
+        
+        if wants_binary_descriptors():
+            return jsonify({
+                'success': True,
+                'descriptor_b64': encode_descriptor(descriptor),
+                'message': 'Face analyzed successfully with advanced AI',
+                'encoding_dimensions': len(descriptor),
+                'model_type': 'deep_learning_128d'
+            })
         
         return jsonify({
             'success': True,
@@ -94,7 +186,7 @@ def analyze_face_from_url():
             }), 400
         
         image_url = data['image_url']
-        logger.info(f"🔍 Analyzing image from URL: {image_url}")
+        logger.debug("🔍 Analyzing image from URL: %s", image_url)
         
         # Get face descriptors using advanced AI
         descriptors = face_service.get_face_descriptors_from_url(image_url)
@@ -117,7 +209,10 @@ def analyze_face_from_url():
             })
         
         # Format response to match expected structure
-        face_encodings = [{'encoding': desc} for desc in descriptors]
+        if wants_binary_descriptors():
+            face_encodings = [{'encoding_b64': encode_descriptor(desc)} for desc in descriptors]
+        else:
+            face_encodings = [{'encoding': desc} for desc in descriptors]
         
         return jsonify({
             'success': True,
@@ -139,55 +234,72 @@ def match_faces():
     """Match user face against photo collection using advanced AI"""
     try:
         data = request.get_json()
+        event_id = data.get('event_id') if data else None
         
-        if not data or 'user_descriptor' not in data or 'photo_collection' not in data:
+        # Either ship the collection, or reference an event indexed earlier
+        if not data or 'user_descriptor' not in data or ('photo_collection' not in data and not event_id):
             return jsonify({
                 'success': False, 
-                'message': 'Missing required data: user_descriptor and photo_collection'
+                'message': 'Missing required data: user_descriptor and photo_collection (or event_id)'
             }), 400
         
-        user_descriptor = data['user_descriptor']
-        photo_collection = data['photo_collection']
-        tolerance = data.get('tolerance', 0.6)
+        if event_id and not EVENT_STATE_ENABLED:
+            return event_state_disabled()
         
-        logger.info(f"🎯 Starting advanced face matching:")
-        logger.info(f"   - User descriptor dimensions: {len(user_descriptor)}")
-        logger.info(f"   - Photos to analyze: {len(photo_collection)}")
-        logger.info(f"   - Tolerance: {tolerance}")
+        photo_collection = data.get('photo_collection')
+        tolerance = data.get('tolerance', 0.6)
         
-        # Validate input data
-        if not isinstance(user_descriptor, list) or not isinstance(photo_collection, list):
+        # Validate input data; user_descriptor is a float list or base64 float32 string
+        if photo_collection is not None and not isinstance(photo_collection, list):
             return jsonify({
                 'success': False, 
                 'message': 'Invalid data format'
             }), 400
-        
-        if len(user_descriptor) != 128:
+        try:
+            user_descriptor = parse_descriptor(data['user_descriptor'], 'user descriptor')
+            top_k = parse_top_k(data.get('top_k', data.get('k')))
+        except ValueError as e:
             return jsonify({
                 'success': False, 
-                'message': f'Invalid user descriptor: expected 128 dimensions, got {len(user_descriptor)}'
+                'message': str(e)
             }), 400
         
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("🎯 Starting advanced face matching:")
+            logger.debug("   - User descriptor dimensions: %d", len(user_descriptor))
+            logger.debug("   - Photos to analyze: %d", len(photo_collection) if photo_collection is not None else face_service.event_size(event_id))
+            logger.debug("   - Tolerance: %s", tolerance)
+        
         # Find matching photos using advanced AI
-        matched_photos = face_service.find_matching_photos(
-            user_descriptor, 
-            photo_collection, 
-            tolerance
-        )
+        if photo_collection is None:
+            if face_service.event_size(event_id) == 0:
+                return jsonify({
+                    'success': False,
+                    'message': f'No descriptors indexed for event {event_id}; send photo_collection first'
+                }), 404
+            matched_photos = face_service.find_matching_photos_in_event(user_descriptor, event_id, tolerance, top_k=top_k)
+            total_photos = face_service.event_size(event_id)
+        else:
+            if event_id:
+                # Cache the stacked collection so later matches can send just the event_id
+                face_service.index_event(event_id, photo_collection)
+                matched_photos = face_service.find_matching_photos_in_event(user_descriptor, event_id, tolerance, top_k=top_k)
+            else:
+                matched_photos = face_service.find_matching_photos(user_descriptor, photo_collection, tolerance, top_k=top_k)
+            total_photos = len(photo_collection)
         
         # Calculate statistics
-        total_photos = len(photo_collection)
         matched_count = len(matched_photos)
         match_rate = (matched_count / total_photos * 100) if total_photos > 0 else 0
+        avg_confidence = sum(photo['score'] for photo in matched_photos) / matched_count if matched_photos else 0
         
-        logger.info(f"✅ Advanced face matching completed:")
-        logger.info(f"   - Total photos: {total_photos}")
-        logger.info(f"   - Matches found: {matched_count}")
-        logger.info(f"   - Match rate: {match_rate:.1f}%")
-        
-        if matched_photos:
-            avg_confidence = sum(photo['score'] for photo in matched_photos) / len(matched_photos)
-            logger.info(f"   - Average confidence: {avg_confidence:.3f}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("✅ Advanced face matching completed:")
+            logger.debug("   - Total photos: %d", total_photos)
+            logger.debug("   - Matches found: %d", matched_count)
+            logger.debug("   - Match rate: %.1f%%", match_rate)
+            if matched_photos:
+                logger.debug("   - Average confidence: %.3f", avg_confidence)
         
         return jsonify({
             'success': True,
@@ -197,7 +309,7 @@ def match_faces():
             'match_rate_percent': round(match_rate, 1),
             'threshold_used': tolerance,
             'model_type': 'advanced_deep_learning',
-            'average_confidence': round(sum(photo['score'] for photo in matched_photos) / len(matched_photos), 3) if matched_photos else 0
+            'average_confidence': round(avg_confidence, 3) if matched_photos else 0
         })
         
     except Exception as e:
@@ -207,6 +319,42 @@ def match_faces():
             'message': str(e)
         }), 500
 
+@app.route('/api/face/ingest', methods=['POST'])
+def ingest_face():
+    """Append a photo descriptor to an event's cached descriptor matrix"""
+    if not EVENT_STATE_ENABLED:
+        return event_state_disabled()
+    try:
+        data = request.get_json()
+        
+        if not data or not data.get('event_id') or not data.get('photo_id') or 'descriptor' not in data:
+            return jsonify({
+                'success': False,
+                'message': 'Missing required data: event_id, photo_id and descriptor'
+            }), 400
+        
+        metadata = {k: data.get(k, '') for k in ('cloudinaryUrl', 'originalName', 'uploadedBy', 'uploadedAt')}
+        descriptor = parse_descriptor(data['descriptor'])
+        size = face_service.add_to_event(data['event_id'], data['photo_id'], descriptor, metadata)
+        
+        return jsonify({
+            'success': True,
+            'event_id': data['event_id'],
+            'indexed_photos': size
+        })
+        
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 400
+    except Exception as e:
+        logger.error(f"❌ Error ingesting face descriptor: {str(e)}")
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 500
+
 
 @app.route('/api/v2/analyze', methods=['POST'])
 def v2_analyze():
@@ -244,6 +392,8 @@ def v2_analyze():
 @app.route('/api/v2/ingest', methods=['POST'])
 def v2_ingest():
     """Ingest a photo (compute ArcFace embedding and add to FAISS), given event_id and either image_url or embedding."""
+    if not EVENT_STATE_ENABLED:
+        return event_state_disabled()
     try:
         data = request.get_json()
         event_id = data.get('event_id')
@@ -259,19 +409,59 @@ def v2_ingest():
         return jsonify({'success': False, 'message': str(e)}), 500
 
 
+# Upper bound on photos per /api/v2/ingest/batch request
+MAX_INGEST_BATCH = 64
+
+
+@app.route('/api/v2/ingest/batch', methods=['POST'])
+def v2_ingest_batch():
+    """Ingest up to MAX_INGEST_BATCH photos for one event in a single request."""
+    if not EVENT_STATE_ENABLED:
+        return event_state_disabled()
+    try:
+        data = request.get_json()
+        event_id = data.get('event_id') if data else None
+        photos = data.get('photos') if data else None
+        if not event_id or not isinstance(photos, list) or not photos:
+            return jsonify({'success': False, 'message': 'event_id and a non-empty photos list are required'}), 400
+        if len(photos) > MAX_INGEST_BATCH:
+            return jsonify({'success': False, 'message': f'At most {MAX_INGEST_BATCH} photos per batch'}), 400
+        if not all(isinstance(p, dict) and p.get('photo_id') for p in photos):
+            return jsonify({'success': False, 'message': 'every photo needs a photo_id'}), 400
+        results = insightface_faiss_service.ingest_batch(event_id, photos)
+        ingested = sum(1 for ok in results.values() if ok)
+        return jsonify({
+            'success': True,
+            'results': results,
+            'ingested': ingested,
+            'failed': len(results) - ingested
+        })
+    except Exception as e:
+        logger.error(f"v2 ingest batch error: {e}")
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+
 @app.route('/api/v2/match', methods=['POST'])
 def v2_match():
     """Match a user embedding against the FAISS index of an event (ArcFace)."""
+    if not EVENT_STATE_ENABLED:
+        return event_state_disabled()
     try:
         data = request.get_json()
         event_id = data.get('event_id')
         user_embedding = data.get('user_embedding')
-        top_k = int(data.get('top_k', 20))
-        threshold = float(data.get('threshold', 0.35))
         if not event_id or not isinstance(user_embedding, list):
             return jsonify({'success': False, 'message': 'event_id and user_embedding are required'}), 400
+        try:
+            top_k = parse_top_k(data.get('top_k'), default=20)
+        except ValueError as e:
+            return jsonify({'success': False, 'message': str(e)}), 400
+        threshold = float(data.get('threshold', 0.35))
         matches = insightface_faiss_service.match(event_id, user_embedding, top_k=top_k, threshold=threshold)
         return jsonify({'success': True, 'matches': matches, 'top_k': top_k, 'threshold_used': threshold})
+    except ValueError as e:
+        # e.g. a 128-d v1 descriptor sent to an event of 512-d ArcFace embeddings
+        return jsonify({'success': False, 'message': str(e)}), 400
     except Exception as e:
         logger.error(f"v2 match error: {e}")
         return jsonify({'success': False, 'message': str(e)}), 500
@@ -288,16 +478,14 @@ def compare_faces():
                 'message': 'Missing required data: descriptor1 and descriptor2'
             }), 400
         
-        descriptor1 = data['descriptor1']
-        descriptor2 = data['descriptor2']
         tolerance = data.get('tolerance', 0.6)
         
-        # Validate descriptors
-        if len(descriptor1) != 128 or len(descriptor2) != 128:
-            return jsonify({
-                'success': False, 
-                'message': 'Invalid descriptors: must be 128-dimensional'
-            }), 400
+        # Validate descriptors (float lists or base64 float32 strings)
+        try:
+            descriptor1 = parse_descriptor(data['descriptor1'], 'descriptor1')
+            descriptor2 = parse_descriptor(data['descriptor2'], 'descriptor2')
+        except ValueError as e:
+            return jsonify({'success': False, 'message': str(e)}), 400
         
         # Compare faces using advanced AI
         comparison = face_service.compare_faces(descriptor1, descriptor2, tolerance)
@@ -336,7 +524,7 @@ def batch_analyze():
                 'message': 'photo_urls must be a non-empty list'
             }), 400
         
-        logger.info(f"🔄 Starting batch analysis of {len(photo_urls)} photos")
+        logger.info("🔄 Starting batch analysis of %d photos", len(photo_urls))
         
         # Batch analyze photos
         results = face_service.batch_analyze_photos(photo_urls)
@@ -394,6 +582,7 @@ if __name__ == '__main__':
     
     # Initialize advanced face recognition service
     if face_service.initialize():
+        face_service.warmup()
         print("✅ Advanced Face Recognition initialized successfully!")
         print("🎯 Ready for industrial-grade face recognition!")
     else:
@@ -404,8 +593,7 @@ if __name__ == '__main__':
     print()
     print("🔥 Starting Advanced Flask Server...")
     print("=" * 60)
+    print("💡 For production, use Gunicorn: gunicorn -c gunicorn.conf.py wsgi:app")
     
-    # Configure app for production-like settings
-    app.config['MAX_CONTENT_LENGTH'] = 10 * 1024 * 1024  # 10MB max file size
-    
-    app.run(debug=True, host='0.0.0.0', port=5000, threaded=True)
+    # The debug reloader re-imports this module and would load the face models twice
+    app.run(debug=DEBUG_MODE, host='0.0.0.0', port=5000, threaded=True)
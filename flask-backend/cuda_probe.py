@@ -0,0 +1,38 @@
+"""
+CUDA detection for the dlib service that never starts the CUDA runtime.
+
+Shared by face_recognition_advanced (which runs in the preloading Gunicorn master),
+gunicorn.conf.py and run_advanced.py so they agree on the worker layout. It must not
+import face_recognition: loading the dlib models here would defeat the master/worker
+split gunicorn.conf.py decides on.
+"""
+
+import os
+
+
+def dlib_uses_cuda() -> bool:
+    """CUDA build with a visible GPU, decided without starting the CUDA runtime.
+
+    A CUDA context created before fork is unusable in the worker, so devices are counted
+    through NVML (or CUDA_VISIBLE_DEVICES when pynvml is missing) instead of
+    dlib.cuda.get_num_devices().
+    """
+    try:
+        import dlib
+    except ImportError:
+        return False
+    if not getattr(dlib, 'DLIB_USE_CUDA', False):
+        return False
+    if 'CUDA_VISIBLE_DEVICES' in os.environ and os.environ['CUDA_VISIBLE_DEVICES'].strip() in ('', '-1'):
+        return False
+    try:
+        import pynvml
+        pynvml.nvmlInit()
+        try:
+            return pynvml.nvmlDeviceGetCount() > 0
+        finally:
+            pynvml.nvmlShutdown()
+    except ImportError:
+        return True
+    except Exception:
+        return False
@@ -4,54 +4,231 @@ Provides industrial-level accuracy for face detection, encoding, and matching
 """
 
 import face_recognition
+import asyncio
 import cv2
 import numpy as np
-from PIL import Image, ImageEnhance, ImageFilter
+from PIL import Image
 import io
+import base64
+import binascii
+import hashlib
 import requests
+from urllib3.util.retry import Retry
 import logging
-from typing import List, Dict, Optional, Tuple, Union
+from typing import Callable, List, Dict, Optional, Tuple, Union
 import time
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from urllib.parse import urlsplit
 import os
+from micro_batcher import MicroBatcher
+from cuda_probe import dlib_uses_cuda
+import _kernels
+
+try:
+    import faiss
+except ImportError:
+    faiss = None
+
+try:
+    import httpx
+    import importlib.util
+    # HTTP/2 needs the h2 extra (httpx[http2]); without it httpx speaks HTTP/1.1
+    _HTTP2 = importlib.util.find_spec('h2') is not None
+except ImportError:
+    httpx = None
+    _HTTP2 = False
 
 
 class _LRUCache:
-    """Simple in-memory LRU cache with TTL for descriptors keyed by image URL."""
+    """Simple in-memory LRU cache with TTL."""
     def __init__(self, capacity: int = 1000, ttl_seconds: int = 3600):
         self.capacity = capacity
         self.ttl = ttl_seconds
-        self.store: Dict[str, Tuple[float, object]] = {}
-        self.order: List[str] = []
+        # key -> (timestamp, value), least recently used first; move_to_end/popitem are O(1)
+        self._od: "OrderedDict[str, Tuple[float, object]]" = OrderedDict()
+        # Request threads share the cache
+        self._lock = threading.Lock()
 
     def get(self, key: str):
         now = time.time()
-        if key in self.store:
-            ts, value = self.store[key]
-            if now - ts <= self.ttl:
-                # refresh order
-                if key in self.order:
-                    self.order.remove(key)
-                self.order.append(key)
-                return value
-            # expired
-            self.delete(key)
-        return None
+        with self._lock:
+            entry = self._od.get(key)
+            if entry is None:
+                return None
+            ts, value = entry
+            if now - ts > self.ttl:
+                # expired
+                del self._od[key]
+                return None
+            self._od.move_to_end(key)
+            return value
 
     def set(self, key: str, value: object):
         now = time.time()
-        if key in self.store:
-            self.order.remove(key)
-        elif len(self.order) >= self.capacity:
-            evict = self.order.pop(0)
-            self.store.pop(evict, None)
-        self.store[key] = (now, value)
-        self.order.append(key)
+        with self._lock:
+            if key in self._od:
+                self._od.move_to_end(key)
+            elif len(self._od) >= self.capacity:
+                self._od.popitem(last=False)
+            self._od[key] = (now, value)
 
     def delete(self, key: str):
-        self.store.pop(key, None)
-        if key in self.order:
-            self.order.remove(key)
+        with self._lock:
+            self._od.pop(key, None)
+
+
+class _DescriptorStore:
+    """Descriptor blocks on disk, one .npy per content key, so a restart doesn't re-encode the gallery.
+
+    Blocks live under a directory named after the detection/encoding settings that produced
+    them; changing any of those starts a fresh set instead of mixing incompatible descriptors.
+    """
+    def __init__(self, root: str, settings: Tuple):
+        digest = hashlib.blake2b(repr(settings).encode(), digest_size=8).hexdigest()
+        self.path = os.path.join(root, digest)
+        os.makedirs(self.path, exist_ok=True)
+
+    def _file(self, key: str) -> str:
+        return os.path.join(self.path, hashlib.blake2b(key.encode(), digest_size=16).hexdigest() + '.npy')
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        try:
+            return np.load(self._file(key))
+        except (OSError, ValueError):
+            return None
+
+    def set(self, key: str, value: np.ndarray) -> None:
+        final = self._file(key)
+        tmp = f"{final}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp, 'wb') as f:
+                np.save(f, value)
+            os.replace(tmp, final)
+        except OSError:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+
+
+class _FuzzyBoxCache:
+    """Face boxes of the last ``capacity`` frames, looked up by 64-bit dHash within a Hamming radius.
+
+    Near-identical frames (webcam bursts, re-uploads of the same shot) reuse boxes instead of
+    re-running detection. Only the micro-batcher worker touches it, so it needs no lock.
+    """
+    def __init__(self, capacity: int = 256, max_distance: int = 4):
+        self.capacity = capacity
+        self.max_distance = max_distance
+        self._hashes = np.zeros(capacity, dtype=np.uint64)
+        self._entries: List[Optional[Tuple[Tuple[int, ...], List[Tuple[int, int, int, int]]]]] = [None] * capacity
+        self._next = 0
+        self._size = 0
+
+    def get(self, frame_hash: np.uint64, shape: Tuple[int, ...]) -> Optional[List[Tuple[int, int, int, int]]]:
+        if self._size == 0:
+            return None
+        diff = np.bitwise_xor(self._hashes[:self._size], frame_hash)
+        distances = np.unpackbits(diff.view(np.uint8)).reshape(self._size, 64).sum(axis=1)
+        for slot in np.argsort(distances, kind='stable'):
+            if distances[slot] > self.max_distance:
+                break
+            cached_shape, boxes = self._entries[slot]
+            # Boxes are pixel coordinates, so only frames of the same size can share them
+            if cached_shape == shape:
+                return boxes
+        return None
+
+    def put(self, frame_hash: np.uint64, shape: Tuple[int, ...], boxes: List[Tuple[int, int, int, int]]) -> None:
+        self._hashes[self._next] = frame_hash
+        self._entries[self._next] = (shape, list(boxes))
+        self._next = (self._next + 1) % self.capacity
+        self._size = min(self._size + 1, self.capacity)
+
+
+def _dhash64(image_rgb: np.ndarray) -> np.uint64:
+    """Difference hash: sign of horizontal luma gradients on a 9x8 thumbnail, packed into 64 bits."""
+    gray = cv2.cvtColor(image_rgb, cv2.COLOR_RGB2GRAY) if image_rgb.ndim == 3 else image_rgb
+    small = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA).astype(np.int16)
+    bits = np.packbits(small[:, 1:] > small[:, :-1])
+    return bits.view(np.uint64)[0]
+
+
+def decode_descriptor(value: Union[str, bytes, List[float], np.ndarray]) -> np.ndarray:
+    """Return a float32 vector from a JSON float list or base64-encoded little-endian float32 bytes."""
+    if isinstance(value, (str, bytes)):
+        return np.frombuffer(base64.b64decode(value), dtype='<f4')
+    return np.asarray(value, dtype=np.float32)
+
+
+def encode_descriptor(value: Union[List[float], np.ndarray]) -> str:
+    """Encode a descriptor as base64 little-endian float32 bytes (4 bytes per value on the wire)."""
+    return base64.b64encode(np.asarray(value, dtype='<f4').tobytes()).decode('ascii')
+
+
+def quantize_rows(rows: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Symmetric per-row int8 quantization: rows ~= codes * scales[:, None]."""
+    scales = np.abs(rows).max(axis=1) / 127.0
+    scales = np.maximum(scales, 1e-12).astype(np.float32)
+    codes = np.rint(rows / scales[:, None]).astype(np.int8)
+    return codes, scales
+
+
+@dataclass
+class EventIndex:
+    """
+    Per-event descriptor store: contiguous (N, 128) float32 rows plus parallel photo metadata.
+    
+    Each row also keeps an int8 code with its scale and squared norm, so large events
+    can be pre-filtered with a 128-byte-per-face scan before the exact float32 rerank.
+    """
+    descriptors: np.ndarray = field(default_factory=lambda: np.zeros((0, 128), dtype=np.float32))
+    codes: np.ndarray = field(default_factory=lambda: np.zeros((0, 128), dtype=np.int8))
+    scales: np.ndarray = field(default_factory=lambda: np.zeros(0, dtype=np.float32))
+    sq_norms: np.ndarray = field(default_factory=lambda: np.zeros(0, dtype=np.float32))
+    photos: List[Dict] = field(default_factory=list)
+    size: int = 0
+    # Optional FAISS index (HNSW, or IVF-PQ for huge events) over the leading rows, built in the background
+    ann: Optional[object] = None
+    ann_factory: str = ''
+    ann_building: bool = False
+    # Factory of the last failed build and when it may be tried again; the int8 scan serves until then
+    ann_failed_factory: str = ''
+    ann_retry_at: float = 0.0
+    ann_lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    @property
+    def matrix(self) -> np.ndarray:
+        return self.descriptors[:self.size]
+
+    @property
+    def quantized(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        return self.codes[:self.size], self.scales[:self.size], self.sq_norms[:self.size]
+
+    def append(self, rows: np.ndarray, photos: List[Dict]) -> None:
+        """Append rows, doubling capacity on overflow so growth stays amortized O(1)."""
+        needed = self.size + rows.shape[0]
+        if needed > self.descriptors.shape[0]:
+            capacity = max(needed, 2 * self.descriptors.shape[0], 64)
+            self.descriptors = self._grow(self.descriptors, (capacity, rows.shape[1]))
+            self.codes = self._grow(self.codes, (capacity, rows.shape[1]))
+            self.scales = self._grow(self.scales, (capacity,))
+            self.sq_norms = self._grow(self.sq_norms, (capacity,))
+        codes, scales = quantize_rows(rows)
+        self.descriptors[self.size:needed] = rows
+        self.codes[self.size:needed] = codes
+        self.scales[self.size:needed] = scales
+        self.sq_norms[self.size:needed] = np.einsum('ij,ij->i', rows, rows)
+        self.photos.extend(photos)
+        self.size = needed
+
+    def _grow(self, buffer: np.ndarray, shape: Tuple[int, ...]) -> np.ndarray:
+        grown = np.empty(shape, dtype=buffer.dtype)
+        grown[:self.size] = buffer[:self.size]
+        return grown
 
 
 class AdvancedFaceRecognitionService:
@@ -65,14 +242,83 @@ class AdvancedFaceRecognitionService:
     - Batch processing optimization
     """
     
+    # Longest image side handed to the detector; larger inputs are scaled down first.
+    # Matches the Cloudinary w_640 rewrite: detection cost scales with pixel count and
+    # encodings are computed from 150x150 chips, so extra resolution buys nothing
+    MAX_IMAGE_SIZE = 640
+    
     def __init__(self):
         self.logger = logging.getLogger(__name__)
         self.initialized = False
-        # Default to CNN for better accuracy; can be overridden
-        self.face_detection_model = 'cnn'  # 'hog' for speed, 'cnn' for accuracy
+        self.MAX_IMAGE_SIZE = int(os.environ.get('FACEMATCH_MAX_IMAGE_SIZE', self.MAX_IMAGE_SIZE))
+        # Default to CNN (better accuracy) when dlib can run it on a GPU, HOG on CPU-only builds;
+        # FACEMATCH_DETECTION_MODEL overrides
+        self.cuda_available = dlib_uses_cuda()
+        self.face_detection_model = os.environ.get('FACEMATCH_DETECTION_MODEL') or ('cnn' if self.cuda_available else 'hog')
+        # Images per batched CNN forward pass (bounded by GPU memory)
+        self.cnn_batch_size = int(os.environ.get('FACEMATCH_CNN_BATCH', '8'))
         self.num_jitters = 1  # Number of times to re-sample for encoding
+        # Bulk event photos use the 5-landmark aligner without jitter (same 128-d space, a fraction of
+        # the landmark cost); the user's reference selfie keeps model='large' and num_jitters
+        self.encode_model = os.environ.get('FACEMATCH_ENCODE_MODEL', 'small')
+        self.encode_jitters = int(os.environ.get('FACEMATCH_ENCODE_JITTERS', '0'))
+        # Optional screen for bulk photos: frames with no HOG hit on a thumbnail this big skip the
+        # detector ladder. HOG needs ~80px faces, so only use it for galleries of close-up shots (0 = off)
+        self.fast_reject_size = int(os.environ.get('FACEMATCH_FAST_REJECT_SIZE', '0'))
+        # HOG passes on a single luma channel (a third of the pixel traffic); encoding still gets color.
+        # Off by default since dlib's RGB HOG takes the strongest gradient per channel and can differ slightly
+        self.detect_gray = os.environ.get('FACEMATCH_DETECT_GRAY') == '1'
+        # Reuse boxes for near-duplicate frames (dHash within FACEMATCH_FUZZY_DISTANCE bits) among the
+        # last FACEMATCH_FUZZY_CACHE frames; 0 = off, since distinct shots from a fixed camera can collide
+        fuzzy_size = int(os.environ.get('FACEMATCH_FUZZY_CACHE', '0'))
+        self.fuzzy_cache = _FuzzyBoxCache(fuzzy_size, int(os.environ.get('FACEMATCH_FUZZY_DISTANCE', '4'))) if fuzzy_size > 0 else None
         self.tolerance = 0.6  # Face matching tolerance (lower = stricter)
-        self.descriptor_cache = _LRUCache(capacity=2000, ttl_seconds=3600)
+        # Parallel URL fetches share one pooled keep-alive session per process
+        self.download_concurrency = int(os.environ.get('FACEMATCH_DOWNLOAD_CONCURRENCY', '32'))
+        # (connect, read) seconds; a stalled CDN node should fail fast and be retried, not hold a thread for 30s
+        self.download_timeout = (3, 10)
+        self._session: Optional[requests.Session] = None
+        self._session_pid: Optional[int] = None
+        # Descriptors are keyed by image content (ETag or hash), so the same photo under two URLs
+        # is encoded once; url_keys lets repeat URLs skip the download as well
+        cache_size = int(os.environ.get('FACEMATCH_URL_CACHE_SIZE', '20000'))
+        cache_ttl = int(os.environ.get('FACEMATCH_URL_CACHE_TTL', '3600'))
+        self.descriptor_cache = _LRUCache(capacity=cache_size, ttl_seconds=cache_ttl)
+        self.url_keys = _LRUCache(capacity=cache_size, ttl_seconds=cache_ttl)
+        # FACEMATCH_DESCRIPTOR_DIR keeps those blocks on disk across restarts and deploys
+        descriptor_dir = os.environ.get('FACEMATCH_DESCRIPTOR_DIR')
+        self.descriptor_store = _DescriptorStore(descriptor_dir, (
+            self.face_detection_model, self.MAX_IMAGE_SIZE, self.encode_model, self.encode_jitters,
+            self.fast_reject_size, self.detect_gray,
+        )) if descriptor_dir else None
+        # Content keys currently being encoded; concurrent callers share the first caller's Future
+        self._inflight: Dict[str, Future] = {}
+        self._inflight_lock = threading.Lock()
+        # Per-event stacked descriptors so matches don't re-ship/re-parse the collection
+        self.events: Dict[str, EventIndex] = {}
+        self._events_lock = threading.Lock()
+        # Events at least this large are pre-filtered with the int8 codes before exact scoring
+        self.int8_scan_min_rows = int(os.environ.get('FACEMATCH_INT8_MIN_ROWS', '2048'))
+        self.int8_rerank_margin = 0.05
+        # Events at least this large get a FAISS index (needs faiss); matches are still re-scored exactly.
+        # HNSW keeps full vectors and answers in ~log N; past ivf_min_rows, IVF-PQ trades recall for memory
+        self.hnsw_min_rows = int(os.environ.get('FACEMATCH_HNSW_MIN_ROWS', '20000'))
+        self.hnsw_factory = os.environ.get('FACEMATCH_HNSW_FACTORY', 'HNSW32')
+        self.hnsw_ef_search = int(os.environ.get('FACEMATCH_HNSW_EF', '64'))
+        self.ivf_min_rows = int(os.environ.get('FACEMATCH_IVF_MIN_ROWS', '200000'))
+        self.ivf_factory = os.environ.get('FACEMATCH_IVF_FACTORY', 'IVF256,PQ16')
+        self.ivf_nprobe = int(os.environ.get('FACEMATCH_IVF_NPROBE', '32'))
+        self.ivf_train_rows = 10000
+        self.ivf_rerank_margin = 0.1
+        # A failed ANN build (e.g. out of memory) is not retried for the same factory before this
+        self.ann_retry_seconds = 300.0
+        # Concurrent requests are coalesced into one detect+encode batch
+        self._batcher = MicroBatcher(
+            self._analyze_batch,
+            batch_size=int(os.getenv('FACEMATCH_MAX_BATCH', '16')),
+            max_latency=float(os.getenv('FACEMATCH_BATCH_WINDOW_MS', '15')) / 1000.0,
+            name='face-batcher'
+        )
         
     def initialize(self) -> bool:
         """Initialize the advanced face recognition service"""
@@ -80,10 +326,12 @@ class AdvancedFaceRecognitionService:
             # Test face_recognition library
             test_image = np.zeros((100, 100, 3), dtype=np.uint8)
             _ = face_recognition.face_locations(test_image)
+            _kernels.warmup()
             
             self.initialized = True
             self.logger.info("✅ Advanced Face Recognition Service initialized successfully")
-            self.logger.info(f"🔧 Configuration: model={self.face_detection_model}, jitters={self.num_jitters}, tolerance={self.tolerance}")
+            self.logger.info(f"🔧 Configuration: model={self.face_detection_model}, jitters={self.num_jitters}, "
+                             f"bulk encoding={self.encode_model}/{self.encode_jitters}, tolerance={self.tolerance}")
             return True
             
         except Exception as e:
@@ -91,92 +339,123 @@ class AdvancedFaceRecognitionService:
             self.logger.error("💡 Make sure to install: pip install face-recognition dlib")
             return False
     
+    def warmup(self) -> None:
+        """
+        Run one synthetic frame through detection and encoding so lazy per-process setup
+        (dlib CNN buffers, CUDA kernels, the batcher thread) happens before the first real request
+        """
+        if not self.initialized:
+            return
+        start = time.time()
+        try:
+            frame = np.full((self.MAX_IMAGE_SIZE * 3 // 4, self.MAX_IMAGE_SIZE, 3), 128, dtype=np.uint8)
+            self._analyze(frame)
+            if self.face_detection_model == 'cnn' and self._batcher.batch_size > 1:
+                # cuDNN picks conv algorithms per batch shape, so prime the one the batched path uses
+                face_recognition.batch_face_locations([frame] * self._batcher.batch_size,
+                                                      number_of_times_to_upsample=1,
+                                                      batch_size=self._batcher.batch_size)
+            # A blank frame has no faces, so drive both landmark models and the encoder with an explicit box
+            face_recognition.face_encodings(frame, [(0, 150, 150, 0)], num_jitters=self.num_jitters, model='large')
+            face_recognition.face_encodings(frame, [(0, 150, 150, 0)], num_jitters=self.encode_jitters, model=self.encode_model)
+            self.logger.info(f"🔥 Face models warmed up in {time.time() - start:.2f}s")
+        except Exception as e:
+            self.logger.warning(f"Face model warmup failed: {str(e)}")
+    
     def _preprocess_image(self, image_array: np.ndarray) -> np.ndarray:
         """
-        Advanced image preprocessing for better face detection
+        Normalize an image to RGB uint8 and cap its size for detection.
+        Enhancement is deferred to _analyze_batch and only applied to frames
+        where no face was found, since dlib's detectors are trained on plain photos.
         """
         try:
-            # Convert to PIL for advanced processing
             if image_array.dtype != np.uint8:
                 image_array = (image_array * 255).astype(np.uint8)
             
-            img_pil = Image.fromarray(image_array)
-            
-            # Resize if too large (performance optimization)
-            max_size = 1024
-            if max(img_pil.size) > max_size:
-                ratio = max_size / max(img_pil.size)
-                new_size = tuple(int(dim * ratio) for dim in img_pil.size)
-                img_pil = img_pil.resize(new_size, Image.Resampling.LANCZOS)
-            
-            # Enhance image quality
-            # 1. Contrast enhancement
-            enhancer = ImageEnhance.Contrast(img_pil)
-            img_pil = enhancer.enhance(1.1)
-            
-            # 2. Brightness adjustment
-            enhancer = ImageEnhance.Brightness(img_pil)
-            img_pil = enhancer.enhance(1.05)
-            
-            # 3. Sharpness enhancement
-            enhancer = ImageEnhance.Sharpness(img_pil)
-            img_pil = enhancer.enhance(1.1)
-            
-            # Convert back to RGB array
-            processed_array = np.array(img_pil)
-            
             # Ensure RGB format
-            if len(processed_array.shape) == 3 and processed_array.shape[2] == 3:
-                return processed_array
-            elif len(processed_array.shape) == 3 and processed_array.shape[2] == 4:
+            if len(image_array.shape) == 3 and image_array.shape[2] == 4:
                 # Convert RGBA to RGB
-                return processed_array[:, :, :3]
-            else:
+                image_array = np.ascontiguousarray(image_array[:, :, :3])
+            elif len(image_array.shape) == 2:
                 # Convert grayscale to RGB
-                return cv2.cvtColor(processed_array, cv2.COLOR_GRAY2RGB)
+                image_array = cv2.cvtColor(image_array, cv2.COLOR_GRAY2RGB)
+            
+            return self._resize_if_large(image_array)
                 
         except Exception as e:
             self.logger.error(f"Error preprocessing image: {str(e)}")
             return image_array
     
-    def _detect_faces_multiple_methods(self, image_rgb: np.ndarray) -> List[Tuple[int, int, int, int]]:
+    def _resize_if_large(self, image_array: np.ndarray) -> np.ndarray:
+        """Downscale so the long side is at most MAX_IMAGE_SIZE (performance optimization)"""
+        max_size = self.MAX_IMAGE_SIZE
+        if max(image_array.shape[:2]) <= max_size:
+            return image_array
+        height, width = image_array.shape[:2]
+        ratio = max_size / max(height, width)
+        # INTER_AREA is the right filter for downscaling and avoids a PIL round-trip
+        return cv2.resize(image_array, (int(width * ratio), int(height * ratio)), interpolation=cv2.INTER_AREA)
+    
+    # 3x3 SMOOTH kernel that PIL's ImageEnhance.Sharpness blends against
+    _LUMA_WEIGHTS = np.array([19595, 38470, 7471], dtype=np.uint32)
+    _SMOOTH_KERNEL = np.array([[1, 1, 1], [1, 5, 1], [1, 1, 1]], dtype=np.float32) / 13
+    
+    def _enhance(self, image_rgb: np.ndarray, contrast: float = 1.1, brightness: float = 1.05, sharpness: float = 1.1) -> np.ndarray:
+        """
+        Contrast, brightness and sharpness enhancement, bit-identical to chaining
+        PIL's ImageEnhance.Contrast/Brightness/Sharpness but without three PIL images:
+        the two affine steps collapse into one 256-entry LUT, sharpening is one 3x3 filter
+        """
+        # Contrast blends toward the rounded mean of the L-converted image (PIL's fixed-point luma)
+        luma = (image_rgb.reshape(-1, 3).astype(np.uint32) @ self._LUMA_WEIGHTS + 0x8000) >> 16
+        mean = int(luma.mean() + 0.5)
+        
+        # PIL blends truncate and clip after every step; a LUT reproduces that exactly
+        levels = np.arange(256, dtype=np.float32)
+        levels = np.clip(np.floor(mean + contrast * (levels - mean)), 0, 255)
+        lut = np.clip(np.floor(brightness * levels), 0, 255).astype(np.uint8)
+        enhanced = cv2.LUT(image_rgb, lut)
+        
+        # Sharpness: blend away from the SMOOTH-filtered image; PIL leaves the 1px border untouched
+        smooth = cv2.filter2D(enhanced, -1, self._SMOOTH_KERNEL, borderType=cv2.BORDER_REPLICATE).astype(np.float32)
+        sharpened = np.floor(smooth + sharpness * (enhanced.astype(np.float32) - smooth))
+        result = np.clip(sharpened, 0, 255).astype(np.uint8)
+        result[0, :], result[-1, :] = enhanced[0, :], enhanced[-1, :]
+        result[:, 0], result[:, -1] = enhanced[:, 0], enhanced[:, -1]
+        return result
+    
+    def _detect_faces_multiple_methods(self, image_rgb: np.ndarray, skip_cnn: bool = False) -> List[Tuple[int, int, int, int]]:
         """
         Use multiple detection methods for robust face detection
         Returns list of face locations as (top, right, bottom, left)
+        skip_cnn: the frame already went through a CNN pass (the batched detector), only run the HOG rungs
         """
         face_locations = []
         
-        # Prioritize configured model first
-        try:
-            primary = face_recognition.face_locations(image_rgb, model=self.face_detection_model)
-            face_locations.extend(primary)
-        except Exception as e:
-            self.logger.warning(f"Primary face detection ({self.face_detection_model}) failed: {str(e)}")
+        # Cheapest detector first, stop at the first one that finds a face:
+        # HOG, HOG with extra upsampling for small faces in large frames, then CNN (GPU only)
+        attempts = [('cnn', 1)] if self.face_detection_model == 'cnn' and not skip_cnn else []
+        attempts.append(('hog', 1))
+        if min(image_rgb.shape[:2]) >= 400:
+            attempts.append(('hog', 2))
+        if self.face_detection_model != 'cnn' and self.cuda_available and not skip_cnn:
+            attempts.append(('cnn', 1))
         
-        # Fallback to the other model if no faces found
-        if len(face_locations) == 0:
+        hog_input = None
+        for model, upsample in attempts:
+            if model == 'hog' and hog_input is None:
+                hog_input = self._hog_input(image_rgb)
             try:
-                fallback_model = 'hog' if self.face_detection_model == 'cnn' else 'cnn'
-                fallback = face_recognition.face_locations(image_rgb, model=fallback_model)
-                face_locations.extend(fallback)
+                face_locations = face_recognition.face_locations(
+                    hog_input if model == 'hog' else image_rgb,
+                    number_of_times_to_upsample=upsample,
+                    model=model
+                )
             except Exception as e:
-                self.logger.warning(f"Fallback face detection failed: {str(e)}")
-        
-        # Method 3: Multi-scale detection if still no faces found
-        if len(face_locations) == 0:
-            try:
-                # Try with different number of upsampling
-                for upsample in [0, 1, 2]:
-                    locations = face_recognition.face_locations(
-                        image_rgb, 
-                        number_of_times_to_upsample=upsample,
-                        model='hog'
-                    )
-                    if locations:
-                        face_locations.extend(locations)
-                        break
-            except Exception as e:
-                self.logger.warning(f"Multi-scale face detection failed: {str(e)}")
+                self.logger.warning("Face detection (%s, upsample=%d) failed: %s", model, upsample, e)
+                continue
+            if face_locations:
+                break
         
         # Remove duplicate detections
         if len(face_locations) > 1:
@@ -184,35 +463,249 @@ class AdvancedFaceRecognitionService:
         
         return face_locations
     
+    def _detect_faces_once(self, image_rgb: np.ndarray) -> List[Tuple[int, int, int, int]]:
+        """Single pass of the configured detector (no fallback ladder)"""
+        try:
+            detector_input = self._hog_input(image_rgb) if self.face_detection_model == 'hog' else image_rgb
+            face_locations = face_recognition.face_locations(detector_input, number_of_times_to_upsample=1, model=self.face_detection_model)
+        except Exception as e:
+            self.logger.warning("Face detection (%s) failed: %s", self.face_detection_model, e)
+            return []
+        return self._remove_duplicate_faces(face_locations) if len(face_locations) > 1 else face_locations
+    
     def _remove_duplicate_faces(self, face_locations: List[Tuple[int, int, int, int]]) -> List[Tuple[int, int, int, int]]:
         """Remove overlapping face detections"""
         if len(face_locations) <= 1:
             return face_locations
         
-        # Calculate areas and remove smaller overlapping faces
-        unique_faces = []
-        for face in face_locations:
-            top, right, bottom, left = face
-            is_duplicate = False
-            
-            for existing_face in unique_faces:
-                ex_top, ex_right, ex_bottom, ex_left = existing_face
-                
-                # Calculate overlap
-                overlap_area = max(0, min(right, ex_right) - max(left, ex_left)) * \
-                              max(0, min(bottom, ex_bottom) - max(top, ex_top))
-                
-                face_area = (right - left) * (bottom - top)
-                existing_area = (ex_right - ex_left) * (ex_bottom - ex_top)
-                
-                if overlap_area > 0.3 * min(face_area, existing_area):
-                    is_duplicate = True
+        # Greedy NMS, largest face first: each kept box drops every remaining box it
+        # overlaps by more than 30% of the smaller area, in one vectorized step
+        boxes = np.asarray(face_locations, dtype=np.int64)
+        top, right, bottom, left = boxes.T
+        areas = (right - left) * (bottom - top)
+        order = np.argsort(-areas, kind='stable')
+        
+        kept = []
+        while order.size > 0:
+            i, rest = order[0], order[1:]
+            kept.append(i)
+            overlap_area = np.maximum(0, np.minimum(right[i], right[rest]) - np.maximum(left[i], left[rest])) * \
+                           np.maximum(0, np.minimum(bottom[i], bottom[rest]) - np.maximum(top[i], top[rest]))
+            order = rest[overlap_area <= 0.3 * np.minimum(areas[i], areas[rest])]
+        
+        # Keep the detector's original ordering
+        return [tuple(int(v) for v in boxes[i]) for i in sorted(kept)]
+    
+    def _canvas_groups(self, images: List[np.ndarray]) -> List[List[int]]:
+        """
+        Greedily group images (largest first) that fit on the first member's canvas
+        while covering at least half of it, so zero-padding wastes at most 2x compute
+        """
+        order = sorted(range(len(images)), key=lambda i: images[i].shape[0] * images[i].shape[1], reverse=True)
+        groups: List[List[int]] = []
+        canvases: List[Tuple[int, int]] = []
+        for i in order:
+            h, w = images[i].shape[:2]
+            for group, (ch, cw) in zip(groups, canvases):
+                if h <= ch and w <= cw and 2 * h * w >= ch * cw and len(group) < self.cnn_batch_size:
+                    group.append(i)
                     break
-            
-            if not is_duplicate:
-                unique_faces.append(face)
+            else:
+                groups.append([i])
+                canvases.append((h, w))
+        return groups
+    
+    def _detect_faces_batch(self, images: List[np.ndarray]) -> List[List[Tuple[int, int, int, int]]]:
+        """
+        Detect faces in several images at once.
+        Images are zero-padded (bottom/right, so coordinates are unchanged) onto shared
+        canvases and run through dlib's CNN as one batch; anything the batch misses
+        falls back to the per-image detection ladder.
+        """
+        results: List[Optional[List[Tuple[int, int, int, int]]]] = [None] * len(images)
+        # Frames the batched CNN pass already searched; empty ones only fall back to HOG
+        covered = [False] * len(images)
+        
+        if self.face_detection_model == 'cnn' and len(images) > 1:
+            for indices in self._canvas_groups(images):
+                if len(indices) < 2:
+                    continue
+                ch, cw = images[indices[0]].shape[:2]
+                batch = []
+                for i in indices:
+                    h, w = images[i].shape[:2]
+                    if (h, w) == (ch, cw):
+                        batch.append(images[i])
+                    else:
+                        canvas = np.zeros((ch, cw, 3), dtype=np.uint8)
+                        canvas[:h, :w] = images[i]
+                        batch.append(canvas)
+                try:
+                    batch_locations = face_recognition.batch_face_locations(
+                        batch,
+                        number_of_times_to_upsample=1,
+                        batch_size=len(batch)
+                    )
+                    for i, locations in zip(indices, batch_locations):
+                        covered[i] = True
+                        if locations:
+                            h, w = images[i].shape[:2]
+                            clipped = [(max(top, 0), min(right, w), min(bottom, h), max(left, 0))
+                                       for top, right, bottom, left in locations]
+                            results[i] = self._remove_duplicate_faces(clipped)
+                except Exception as e:
+                    self.logger.warning("Batched face detection failed: %s", e)
+        
+        for i, image in enumerate(images):
+            if results[i] is None:
+                results[i] = self._detect_faces_multiple_methods(image, skip_cnn=covered[i])
+        
+        return results
+    
+    def _analyze_batch(self, items: List[Tuple[np.ndarray, str, int, bool]]) -> List[object]:
+        """
+        Detect and encode faces for a batch of (image, encode model, jitters, screen) items:
+        one (locations, encodings) per item. Screened items that fail the fast check skip detection
+        """
+        images = [image_rgb for image_rgb, _, _, _ in items]
+        rejected = [screen and not self._has_any_face_fast(image_rgb) for image_rgb, _, _, screen in items]
+        hashes: List[Optional[np.uint64]] = [None] * len(items)
+        cached: List[Optional[List[Tuple[int, int, int, int]]]] = [None] * len(items)
+        if self.fuzzy_cache is not None:
+            for i, (image_rgb, skip) in enumerate(zip(images, rejected)):
+                if not skip:
+                    hashes[i] = _dhash64(image_rgb)
+                    cached[i] = self.fuzzy_cache.get(hashes[i], image_rgb.shape)
+        detected = iter(self._detect_faces_batch([
+            image_rgb for image_rgb, skip, hit in zip(images, rejected, cached) if not skip and hit is None
+        ]))
+        results: List[object] = []
+        # (encode model, jitters) -> [(result index, image, locations)]
+        frames: Dict[Tuple[str, int], List[Tuple[int, np.ndarray, List[Tuple[int, int, int, int]]]]] = {}
+        for i, ((_, model, jitters, _), image_rgb, skip) in enumerate(zip(items, images, rejected)):
+            if skip:
+                results.append(([], []))
+                continue
+            face_locations = cached[i] if cached[i] is not None else next(detected)
+            try:
+                if len(face_locations) == 0 and cached[i] is None:
+                    # Only marginal frames benefit from enhancement: retry once on an enhanced copy
+                    image_rgb = self._enhance(image_rgb)
+                    face_locations = self._detect_faces_once(image_rgb)
+                if hashes[i] is not None and cached[i] is None:
+                    self.fuzzy_cache.put(hashes[i], images[i].shape, face_locations)
+                results.append((face_locations, []))
+                if len(face_locations) > 0:
+                    frames.setdefault((model, jitters), []).append((len(results) - 1, image_rgb, face_locations))
+            except Exception as e:
+                results.append(e)
+        
+        for (model, jitters), group in frames.items():
+            encoded = self._encode_faces([(image_rgb, face_locations) for _, image_rgb, face_locations in group], model, jitters)
+            for n, (i, image_rgb, face_locations) in enumerate(group):
+                try:
+                    face_encodings = encoded[n] if encoded is not None else face_recognition.face_encodings(
+                        image_rgb,
+                        face_locations,
+                        num_jitters=jitters,
+                        model=model
+                    )
+                    results[i] = (face_locations, face_encodings)
+                except Exception as e:
+                    results[i] = e
+        return results
+    
+    def _encode_faces(self, frames: List[Tuple[np.ndarray, List[Tuple[int, int, int, int]]]], model: str, jitters: int) -> Optional[List[List[np.ndarray]]]:
+        """
+        Encode the faces of several frames with one batched call to dlib's ResNet.
+        Chips are aligned exactly like face_recognition.face_encodings (150px, 0.25 padding),
+        so results match; returns None when the batched path fails and encodings are done per frame
+        """
+        if not frames:
+            return []
+        try:
+            import dlib
+            chips, counts = [], []
+            for image_rgb, face_locations in frames:
+                shapes = face_recognition.api._raw_face_landmarks(image_rgb, face_locations, model=model)
+                chips.extend(dlib.get_face_chip(image_rgb, shape, size=150, padding=0.25) for shape in shapes)
+                counts.append(len(shapes))
+            descriptors = list(face_recognition.api.face_encoder.compute_face_descriptor(chips, jitters))
+            if len(descriptors) != len(chips):
+                raise RuntimeError(f"{len(descriptors)} descriptors for {len(chips)} chips")
+        except Exception as e:
+            self.logger.debug("Batched encoding unavailable, encoding per frame: %s", e)
+            return None
         
-        return unique_faces
+        encodings, offset = [], 0
+        for count in counts:
+            encodings.append([np.array(d) for d in descriptors[offset:offset + count]])
+            offset += count
+        return encodings
+    
+    def _analyze(self, image_rgb: np.ndarray, precise: bool = False) -> Tuple[List[Tuple[int, int, int, int]], List[np.ndarray]]:
+        """
+        Detect and encode faces in one image via the shared micro-batcher.
+        precise=True encodes with the 68-landmark model and num_jitters (reference selfies)
+        """
+        return self._submit(image_rgb, precise).result()
+    
+    def _submit(self, image_rgb: np.ndarray, precise: bool = False) -> Future:
+        if precise:
+            return self._batcher.submit((image_rgb, 'large', self.num_jitters, False))
+        return self._batcher.submit((image_rgb, self.encode_model, self.encode_jitters, self.fast_reject_size > 0))
+    
+    def _hog_input(self, image_rgb: np.ndarray) -> np.ndarray:
+        """Frame for dlib's HOG detector: single-channel luma when FACEMATCH_DETECT_GRAY=1 (CNN needs RGB)"""
+        if self.detect_gray and image_rgb.ndim == 3:
+            return cv2.cvtColor(image_rgb, cv2.COLOR_RGB2GRAY)
+        return image_rgb
+    
+    def _has_any_face_fast(self, image_rgb: np.ndarray) -> bool:
+        """Cheap screen: HOG without upsampling on a fast_reject_size thumbnail"""
+        ratio = self.fast_reject_size / max(image_rgb.shape[:2])
+        small = image_rgb
+        if ratio < 1:
+            small = cv2.resize(image_rgb, (0, 0), fx=ratio, fy=ratio, interpolation=cv2.INTER_AREA)
+        try:
+            return len(face_recognition.face_locations(self._hog_input(small), number_of_times_to_upsample=0, model='hog')) > 0
+        except Exception:
+            return True
+    
+    def _decode_flag(self, image_data: bytes) -> int:
+        """
+        Pick the coarsest libjpeg DCT scale (1/8, 1/4, 1/2) that still leaves at least
+        MAX_IMAGE_SIZE pixels on the long side, so big JPEGs are never decoded at full size
+        """
+        try:
+            # Image.open only parses the header here
+            with Image.open(io.BytesIO(image_data)) as header:
+                if header.format != 'JPEG':
+                    return cv2.IMREAD_COLOR
+                longest = max(header.size)
+        except Exception:
+            return cv2.IMREAD_COLOR
+        
+        for factor, flag in ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4), (2, cv2.IMREAD_REDUCED_COLOR_2)):
+            if longest // factor >= self.MAX_IMAGE_SIZE:
+                return flag
+        return cv2.IMREAD_COLOR
+    
+    def decode_image(self, image_data: bytes) -> Optional[np.ndarray]:
+        """Decode encoded image bytes straight to an RGB uint8 array"""
+        image_bgr = cv2.imdecode(np.frombuffer(image_data, dtype=np.uint8), self._decode_flag(image_data))
+        if image_bgr is not None:
+            return cv2.cvtColor(image_bgr, cv2.COLOR_BGR2RGB)
+        
+        # Formats OpenCV can't read (e.g. GIF) go through PIL
+        try:
+            image = Image.open(io.BytesIO(image_data))
+            if image.mode != 'RGB':
+                image = image.convert('RGB')
+            return np.array(image)
+        except Exception as e:
+            self.logger.error(f"Error decoding image: {str(e)}")
+            return None
     
     def load_image_from_file(self, image_file) -> Optional[np.ndarray]:
         """Load and preprocess image from uploaded file"""
@@ -224,13 +717,9 @@ class AdvancedFaceRecognitionService:
             else:
                 image_data = image_file
             
-            image = Image.open(io.BytesIO(image_data))
-            
-            # Convert to RGB
-            if image.mode != 'RGB':
-                image = image.convert('RGB')
-            
-            image_array = np.array(image)
+            image_array = self.decode_image(image_data)
+            if image_array is None:
+                return None
             
             # Preprocess for better detection
             processed_image = self._preprocess_image(image_array)
@@ -241,40 +730,139 @@ class AdvancedFaceRecognitionService:
             self.logger.error(f"Error loading image from file: {str(e)}")
             return None
     
-    def load_image_from_url(self, image_url: str) -> Optional[np.ndarray]:
-        """Load and preprocess image from URL"""
+    USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+    
+    def _http(self) -> requests.Session:
+        """Keep-alive session shared by request threads; recreated after fork so workers don't share sockets"""
+        if self._session is None or self._session_pid != os.getpid():
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(
+                pool_connections=32,
+                pool_maxsize=self.download_concurrency,
+                max_retries=Retry(total=2, backoff_factor=0.3, status_forcelist=(502, 503, 504))
+            )
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            session.headers['User-Agent'] = self.USER_AGENT
+            self._session, self._session_pid = session, os.getpid()
+        return self._session
+    
+    def _optimized_url(self, image_url: str) -> str:
+        # If Cloudinary URL without transformation, request a smaller rendition for speed
+        if 'res.cloudinary.com' in image_url and '/image/upload/' in image_url and ('/w_' not in image_url):
+            return image_url.replace('/image/upload/', '/image/upload/w_640,q_75,c_limit,fl_lossy/')
+        return image_url
+    
+    def _download(self, image_url: str) -> Optional[Tuple[str, bytes]]:
+        """Fetch image bytes and their content key for the descriptor cache"""
         try:
-            headers = {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-            }
-            # If Cloudinary URL without transformation, request a smaller rendition for speed
-            optimized_url = image_url
-            try:
-                if 'res.cloudinary.com' in image_url and '/image/upload/' in image_url and ('/w_' not in image_url):
-                    optimized_url = image_url.replace('/image/upload/', '/image/upload/w_640,q_75,c_limit,fl_lossy/')
-            except Exception:
-                pass
-
-            response = requests.get(optimized_url, timeout=30, headers=headers)
+            optimized_url = self._optimized_url(image_url)
+            response = self._http().get(optimized_url, timeout=self.download_timeout)
             response.raise_for_status()
-            
-            image = Image.open(io.BytesIO(response.content))
-            
-            # Convert to RGB
-            if image.mode != 'RGB':
-                image = image.convert('RGB')
-            
-            image_array = np.array(image)
-            
-            # Preprocess for better detection
-            processed_image = self._preprocess_image(image_array)
-            
-            return processed_image
+            return self._content_key(optimized_url, response), response.content
             
         except Exception as e:
             self.logger.error(f"Error loading image from URL {image_url}: {str(e)}")
             return None
     
+    async def _download_all(self, urls: List[Tuple[int, str]], on_downloaded: Callable[[int, Optional[Tuple[str, bytes]]], None]) -> None:
+        """
+        Fetch (index, url) pairs concurrently on one event loop (HTTP/2 when available);
+        on_downloaded(index, (key, bytes) or None) runs as each body lands
+        """
+        limits = httpx.Limits(max_connections=self.download_concurrency, max_keepalive_connections=self.download_concurrency)
+        transport = httpx.AsyncHTTPTransport(retries=2, http2=_HTTP2, limits=limits)
+        timeout = httpx.Timeout(self.download_timeout[1], connect=self.download_timeout[0])
+        
+        async with httpx.AsyncClient(transport=transport, timeout=timeout, headers={'User-Agent': self.USER_AGENT}) as client:
+            async def fetch(i: int, image_url: str) -> None:
+                optimized_url = self._optimized_url(image_url)
+                try:
+                    response = await client.get(optimized_url)
+                    response.raise_for_status()
+                    downloaded = (self._content_key(optimized_url, response), response.content)
+                except Exception as e:
+                    self.logger.error(f"Error loading image from URL {image_url}: {str(e)}")
+                    downloaded = None
+                on_downloaded(i, downloaded)
+            
+            await asyncio.gather(*(fetch(i, url) for i, url in urls))
+    
+    def _content_key(self, url: str, response: Union[requests.Response, 'httpx.Response']) -> str:
+        """Strong ETag (scoped to the host) when the CDN sends one, otherwise a digest of the body"""
+        etag = response.headers.get('ETag')
+        if etag and not etag.startswith('W/'):
+            return 'etag:' + urlsplit(url).netloc + ':' + etag.strip('"')
+        return 'blake2b:' + hashlib.blake2b(response.content, digest_size=16).hexdigest()
+    
+    def _decode_frame(self, image_data: bytes) -> Optional[np.ndarray]:
+        image_array = self.decode_image(image_data)
+        if image_array is None:
+            return None
+        # Preprocess for better detection
+        return self._preprocess_image(image_array)
+    
+    def load_image_from_url(self, image_url: str) -> Optional[np.ndarray]:
+        """Load and preprocess image from URL"""
+        downloaded = self._download(image_url)
+        return self._decode_frame(downloaded[1]) if downloaded is not None else None
+    
+    def _cached_for_url(self, image_url: str) -> Optional[np.ndarray]:
+        """Descriptor block for a URL already seen, without touching the network"""
+        key = self.url_keys.get(image_url)
+        return self.descriptor_cache.get(key) if key is not None else None
+    
+    def _analyze_download(self, image_url: str, downloaded: Optional[Tuple[str, bytes]]) -> Optional[Union[np.ndarray, Future]]:
+        """
+        Resolve a download against the content cache: the cached descriptor block on a hit,
+        otherwise decode it and return the Future of its inference. None when the download/decode
+        failed (not cached: failures may be transient)
+        """
+        if downloaded is None:
+            return None
+        key, image_data = downloaded
+        self.url_keys.set(image_url, key)
+        cached = self.descriptor_cache.get(key)
+        if cached is None and self.descriptor_store is not None:
+            cached = self.descriptor_store.get(key)
+            if cached is not None:
+                self.descriptor_cache.set(key, cached)
+        if cached is not None:
+            return cached
+        image_rgb = self._decode_frame(image_data)
+        if image_rgb is None:
+            return None
+        return self._describe(key, image_rgb)
+    
+    def _describe(self, key: str, image_rgb: np.ndarray) -> Future:
+        """
+        Future of the (K, 128) descriptor block for one frame, cached under its content key.
+        Concurrent requests for the same new image wait on the first one instead of re-encoding it
+        """
+        with self._inflight_lock:
+            future = self._inflight.get(key)
+            if future is not None:
+                return future
+            future = Future()
+            self._inflight[key] = future
+        # Detect and encode faces (batched with concurrent requests)
+        self._submit(image_rgb).add_done_callback(lambda inference: self._finish_describe(key, future, inference))
+        return future
+    
+    def _finish_describe(self, key: str, future: Future, inference: Future) -> None:
+        try:
+            face_locations, face_encodings = inference.result()
+            encodings = self._descriptor_block(face_locations, face_encodings)
+            self.descriptor_cache.set(key, encodings)
+            if self.descriptor_store is not None:
+                self.descriptor_store.set(key, encodings)
+            future.set_result(encodings)
+        except Exception as e:
+            future.set_exception(e)
+        finally:
+            with self._inflight_lock:
+                self._inflight.pop(key, None)
+    
     def get_face_descriptor(self, image_input: Union[np.ndarray, object]) -> List[float]:
         """
         Extract high-quality 128-dimensional face encoding from image
@@ -297,23 +885,15 @@ class AdvancedFaceRecognitionService:
                 if image_rgb is None:
                     raise Exception("Could not load image")
             
-            self.logger.info(f"🔍 Analyzing image of shape: {image_rgb.shape}")
+            self.logger.debug("🔍 Analyzing image of shape: %s", image_rgb.shape)
             
-            # Detect faces using multiple methods
-            face_locations = self._detect_faces_multiple_methods(image_rgb)
+            # Detect and encode faces (batched with concurrent requests)
+            face_locations, face_encodings = self._analyze(image_rgb, precise=True)
             
             if len(face_locations) == 0:
                 raise Exception("No faces found in the image. Please ensure the image contains a clear, front-facing face with good lighting.")
             
-            self.logger.info(f"✅ Found {len(face_locations)} face(s) in image")
-            
-            # Get face encodings for all detected faces
-            face_encodings = face_recognition.face_encodings(
-                image_rgb, 
-                face_locations, 
-                num_jitters=self.num_jitters,
-                model='large'  # Use the more accurate model
-            )
+            self.logger.debug("✅ Found %d face(s) in image", len(face_locations))
             
             if len(face_encodings) == 0:
                 raise Exception("Could not generate face encoding. Face might be too blurry or at a bad angle.")
@@ -324,14 +904,14 @@ class AdvancedFaceRecognitionService:
                 face_sizes = [(bottom - top) * (right - left) for top, right, bottom, left in face_locations]
                 largest_face_idx = np.argmax(face_sizes)
                 selected_encoding = face_encodings[largest_face_idx]
-                self.logger.info(f"🎯 Selected largest face (index {largest_face_idx}) from {len(face_locations)} detected faces")
+                self.logger.debug("🎯 Selected largest face (index %d) from %d detected faces", largest_face_idx, len(face_locations))
             else:
                 selected_encoding = face_encodings[0]
             
-            # Convert to list for JSON serialization
-            encoding_list = selected_encoding.tolist()
+            # Convert to list for JSON serialization (float32 like every stored descriptor)
+            encoding_list = np.asarray(selected_encoding, dtype=np.float32).tolist()
             
-            self.logger.info(f"✅ Successfully extracted 128-dimensional face encoding")
+            self.logger.debug("✅ Successfully extracted 128-dimensional face encoding")
             return encoding_list
             
         except Exception as e:
@@ -346,43 +926,30 @@ class AdvancedFaceRecognitionService:
             List of face encodings (each encoding is a list of 128 floats)
         """
         try:
-            # Cache by URL to avoid repeated downloads/compute in-session
-            cached = self.descriptor_cache.get(image_url)
-            if cached is not None:
-                return cached
-
-            image_rgb = self.load_image_from_url(image_url)
-            if image_rgb is None:
-                return None
-            
-            # Detect faces
-            face_locations = self._detect_faces_multiple_methods(image_rgb)
-            
-            if len(face_locations) == 0:
-                return None
-            
-            # Get encodings for all faces
-            face_encodings = face_recognition.face_encodings(
-                image_rgb, 
-                face_locations, 
-                num_jitters=self.num_jitters,
-                model='large'
-            )
-            
-            if len(face_encodings) == 0:
-                return None
-            
-            # Convert all encodings to lists
-            encodings_list = [encoding.tolist() for encoding in face_encodings]
-            self.descriptor_cache.set(image_url, encodings_list)
-            
-            return encodings_list
+            # Known URLs skip the download; new URLs may still hit by content
+            cached = self._cached_for_url(image_url)
+            if cached is None:
+                outcome = self._analyze_download(image_url, self._download(image_url))
+                if outcome is None:
+                    return None
+                cached = outcome.result() if isinstance(outcome, Future) else outcome
+            return self._cached_descriptors(cached)
             
         except Exception as e:
-            self.logger.warning(f"Error getting face descriptors from URL: {str(e)}")
+            self.logger.warning("Error getting face descriptors from URL: %s", e)
             return None
     
-    def compare_faces(self, descriptor1: List[float], descriptor2: List[float], tolerance: Optional[float] = None) -> Dict:
+    def _descriptor_block(self, face_locations: List, face_encodings: List) -> np.ndarray:
+        """One frame's encodings as the cached (K, 128) float32 block (512 bytes per face instead of 128 boxed floats)"""
+        if len(face_locations) == 0 or len(face_encodings) == 0:
+            return np.zeros((0, 128), dtype=np.float32)
+        return np.asarray(face_encodings, dtype=np.float32)
+    
+    def _cached_descriptors(self, encodings: np.ndarray) -> Optional[List[List[float]]]:
+        # An empty block records a photo already known to contain no faces
+        return encodings.tolist() if len(encodings) else None
+    
+    def compare_faces(self, descriptor1: Union[List[float], np.ndarray], descriptor2: Union[List[float], np.ndarray], tolerance: Optional[float] = None) -> Dict:
         """
         Compare two face descriptors with high accuracy
         
@@ -398,17 +965,16 @@ class AdvancedFaceRecognitionService:
             if tolerance is None:
                 tolerance = self.tolerance
             
-            # Convert to numpy arrays
-            encoding1 = np.array(descriptor1)
-            encoding2 = np.array(descriptor2)
+            # Convert once to float32 and compute all pair statistics in a single pass
+            encoding1 = decode_descriptor(descriptor1)
+            encoding2 = decode_descriptor(descriptor2)
+            if encoding1.ndim != 1 or encoding1.shape != encoding2.shape:
+                raise ValueError(f"Descriptor shapes differ: {encoding1.shape} vs {encoding2.shape}")
             
-            # Calculate Euclidean distance
-            distance = np.linalg.norm(encoding1 - encoding2)
+            distance, dot, norm1, norm2 = _kernels.pair_stats(encoding1, encoding2)
             
             # Calculate cosine similarity
-            cosine_similarity = np.dot(encoding1, encoding2) / (
-                np.linalg.norm(encoding1) * np.linalg.norm(encoding2)
-            )
+            cosine_similarity = dot / max(norm1 * norm2, 1e-12)
             
             # Determine if faces match
             is_match = distance <= tolerance
@@ -434,7 +1000,114 @@ class AdvancedFaceRecognitionService:
                 'tolerance_used': float(tolerance or self.tolerance)
             }
     
-    def find_matching_photos(self, user_descriptor: List[float], photo_collection: List[Dict], tolerance: Optional[float] = None) -> List[Dict]:
+    def _stack_descriptors(self, photo_collection: List[Dict]) -> Tuple[List[Dict], np.ndarray]:
+        """Stack collection descriptors into one contiguous (N, 128) float32 matrix"""
+        # One pass to filter, then a single conversion for the whole block
+        photos, descriptors = [], []
+        encoded = False
+        for photo_data in photo_collection:
+            descriptor = photo_data.get('descriptor')
+            if descriptor is None or len(descriptor) == 0:
+                continue
+            if isinstance(descriptor, (str, bytes)):
+                encoded = True
+            elif len(descriptor) != 128:
+                continue
+            photos.append(photo_data)
+            descriptors.append(descriptor)
+        
+        if not photos:
+            return photos, np.zeros((0, 128), dtype=np.float32)
+        if not encoded:
+            return photos, np.asarray(descriptors, dtype=np.float32)
+        
+        # base64 float32 payloads: decode to raw bytes, skip anything malformed, parse with one frombuffer
+        kept, chunks = [], []
+        for photo_data, descriptor in zip(photos, descriptors):
+            try:
+                if isinstance(descriptor, (str, bytes)):
+                    raw = base64.b64decode(descriptor)
+                else:
+                    raw = np.asarray(descriptor, dtype='<f4').tobytes()
+            except (binascii.Error, ValueError, TypeError):
+                continue
+            if len(raw) == 128 * 4:
+                kept.append(photo_data)
+                chunks.append(raw)
+        gallery = np.frombuffer(b''.join(chunks), dtype='<f4').reshape(-1, 128)
+        return kept, gallery
+    
+    def _match_gallery(self, probe: np.ndarray, photos: List[Dict], gallery: np.ndarray, tolerance: float,
+                       top_k: Optional[int] = None, sq_norms: Optional[np.ndarray] = None) -> List[Dict]:
+        """Score a probe against a stacked (N, 128) gallery and build sorted match dicts"""
+        return self._match_gallery_batch(probe.reshape(1, -1), photos, gallery, tolerance, top_k, sq_norms)[0]
+    
+    def _match_gallery_batch(self, probes: np.ndarray, photos: List[Dict], gallery: np.ndarray, tolerance: float,
+                             top_k: Optional[int] = None, sq_norms: Optional[np.ndarray] = None) -> List[List[Dict]]:
+        """Score (M, 128) probes against a stacked (N, 128) gallery: one sorted match list per probe"""
+        if gallery.shape[0] == 0:
+            return [[] for _ in range(probes.shape[0])]
+        
+        # One GEMV (GEMM for several probes) bounds every squared distance (|g|^2 - 2 g.p + |p|^2);
+        # exact scores are only computed for rows that can still pass both the tolerance and the 0.4 confidence cut
+        if probes.shape[0] == 1:
+            dots = _kernels.gallery_dots(gallery, probes[0]).reshape(1, -1)
+        else:
+            dots = probes @ gallery.T
+        if sq_norms is None:
+            sq_norms = np.einsum('ij,ij->i', gallery, gallery)
+        limit = min(tolerance, 0.72) + 1e-4
+        return [self._build_matches(probe, photos, gallery, tolerance, top_k, probe_dots, sq_norms, limit)
+                for probe, probe_dots in zip(probes, dots)]
+    
+    def _build_matches(self, probe: np.ndarray, photos: List[Dict], gallery: np.ndarray, tolerance: float,
+                       top_k: Optional[int], dots: np.ndarray, sq_norms: np.ndarray, limit: float) -> List[Dict]:
+        matched_photos = []
+        probe_sq = float(probe @ probe)
+        rows = np.nonzero(sq_norms - 2.0 * dots + probe_sq <= limit * limit)[0]
+        
+        distances = np.linalg.norm(gallery[rows] - probe, axis=1)
+        norms = np.sqrt(sq_norms[rows]) * np.sqrt(probe_sq)
+        similarities = dots[rows] / np.maximum(norms, 1e-12)
+        confidences = np.maximum(0.0, 1.0 - distances / 1.2)
+        
+        # Only include high-confidence matches within tolerance
+        candidates = np.nonzero((distances <= tolerance) & (confidences >= 0.4))[0]
+        if top_k and len(candidates) > top_k:
+            # O(N) partial selection instead of sorting every candidate
+            candidates = candidates[np.argpartition(distances[candidates], top_k - 1)[:top_k]]
+        
+        # Sort by confidence score (highest first)
+        for i in candidates[np.argsort(distances[candidates], kind='stable')]:
+            photo_data = photos[rows[i]]
+            matched_photos.append({
+                "id": photo_data['id'],
+                "score": float(confidences[i]),
+                "similarity": float(similarities[i]),
+                "distance": float(distances[i]),
+                "cloudinaryUrl": photo_data.get('cloudinaryUrl', ''),
+                "originalName": photo_data.get('originalName', ''),
+                "uploadedBy": photo_data.get('uploadedBy', ''),
+                "uploadedAt": photo_data.get('uploadedAt', ''),
+                "tolerance_used": float(tolerance)
+            })
+        return matched_photos
+    
+    def _log_match_summary(self, total: int, comparisons_made: int, matched_photos: List[Dict], tolerance: float) -> None:
+        if not self.logger.isEnabledFor(logging.DEBUG):
+            return
+        self.logger.debug("✅ Face matching completed:")
+        self.logger.debug("   - Photos analyzed: %d", total)
+        self.logger.debug("   - Comparisons made: %d", comparisons_made)
+        self.logger.debug("   - Matches found: %d", len(matched_photos))
+        self.logger.debug("   - Tolerance used: %s", tolerance)
+        
+        if matched_photos:
+            avg_confidence = sum(photo['score'] for photo in matched_photos) / len(matched_photos)
+            self.logger.debug("   - Average confidence: %.3f", avg_confidence)
+            self.logger.debug("   - Best match confidence: %.3f", matched_photos[0]['score'])
+    
+    def find_matching_photos(self, user_descriptor: Union[List[float], np.ndarray], photo_collection: List[Dict], tolerance: Optional[float] = None, top_k: Optional[int] = None) -> List[Dict]:
         """
         Find photos that match the user's face with high accuracy
         
@@ -442,6 +1115,7 @@ class AdvancedFaceRecognitionService:
             user_descriptor: User's face encoding
             photo_collection: List of photo objects with descriptors
             tolerance: Matching tolerance (default: 0.6, lower = stricter)
+            top_k: Optional cap on the number of (best) matches returned
             
         Returns:
             List of matching photos with confidence scores
@@ -453,49 +1127,200 @@ class AdvancedFaceRecognitionService:
             if tolerance is None:
                 tolerance = self.tolerance
             
-            matched_photos = []
-            comparisons_made = 0
+            self.logger.debug("🎯 Starting face matching with tolerance: %s", tolerance)
             
-            self.logger.info(f"🎯 Starting face matching with tolerance: {tolerance}")
+            probe = decode_descriptor(user_descriptor)
+            photos, gallery = self._stack_descriptors(photo_collection)
+            matched_photos = self._match_gallery(probe, photos, gallery, tolerance, top_k)
             
-            for photo_data in photo_collection:
-                if 'descriptor' not in photo_data or not photo_data['descriptor']:
-                    continue
-                
-                comparisons_made += 1
-                
-                # Compare faces using advanced algorithm
-                comparison = self.compare_faces(user_descriptor, photo_data['descriptor'], tolerance)
-                
-                if comparison['is_match']:
-                    # Only include high-confidence matches
-                    if comparison['confidence'] >= 0.4:  # Minimum confidence threshold
-                        matched_photos.append({
-                            "id": photo_data['id'],
-                            "score": comparison['confidence'],
-                            "similarity": comparison['similarity'],
-                            "distance": comparison['distance'],
-                            "cloudinaryUrl": photo_data.get('cloudinaryUrl', ''),
-                            "originalName": photo_data.get('originalName', ''),
-                            "uploadedBy": photo_data.get('uploadedBy', ''),
-                            "uploadedAt": photo_data.get('uploadedAt', ''),
-                            "tolerance_used": comparison['tolerance_used']
-                        })
-            
-            # Sort by confidence score (highest first)
-            matched_photos.sort(key=lambda x: x['score'], reverse=True)
-            
-            self.logger.info(f"✅ Face matching completed:")
-            self.logger.info(f"   - Photos analyzed: {len(photo_collection)}")
-            self.logger.info(f"   - Comparisons made: {comparisons_made}")
-            self.logger.info(f"   - Matches found: {len(matched_photos)}")
-            self.logger.info(f"   - Tolerance used: {tolerance}")
-            
-            if matched_photos:
-                avg_confidence = sum(photo['score'] for photo in matched_photos) / len(matched_photos)
-                self.logger.info(f"   - Average confidence: {avg_confidence:.3f}")
-                self.logger.info(f"   - Best match confidence: {matched_photos[0]['score']:.3f}")
+            self._log_match_summary(len(photo_collection), len(photos), matched_photos, tolerance)
+            return matched_photos
             
+        except Exception as e:
+            self.logger.error(f"Error finding matching photos: {str(e)}")
+            raise Exception(f"Failed to find matching photos: {str(e)}")
+    
+    def find_matching_photos_batch(self, user_descriptors: List[Union[List[float], np.ndarray]], photo_collection: List[Dict], tolerance: Optional[float] = None, top_k: Optional[int] = None) -> List[List[Dict]]:
+        """
+        Match several users against one photo collection with a single GEMM
+        
+        Args:
+            user_descriptors: Face encodings of the users (e.g. a guest list)
+            photo_collection: List of photo objects with descriptors
+            tolerance: Matching tolerance (default: 0.6, lower = stricter)
+            top_k: Optional cap on the number of (best) matches returned per user
+            
+        Returns:
+            One list of matching photos per user descriptor, in input order
+        """
+        if not self.initialized:
+            raise Exception("Advanced face recognition service not initialized")
+        
+        try:
+            if tolerance is None:
+                tolerance = self.tolerance
+            
+            probes = np.stack([decode_descriptor(d) for d in user_descriptors]) if user_descriptors else np.zeros((0, 128), dtype=np.float32)
+            photos, gallery = self._stack_descriptors(photo_collection)
+            matches = self._match_gallery_batch(probes, photos, gallery, tolerance, top_k)
+            
+            if self.logger.isEnabledFor(logging.DEBUG):
+                self.logger.debug("✅ Batch matching of %d users over %d photos: %d matches",
+                                  len(matches), len(photos), sum(len(m) for m in matches))
+            return matches
+            
+        except Exception as e:
+            self.logger.error(f"Error finding matching photos: {str(e)}")
+            raise Exception(f"Failed to find matching photos: {str(e)}")
+    
+    def index_event(self, event_id: str, photo_collection: List[Dict]) -> int:
+        """
+        Replace an event's cached descriptor matrix with the given collection
+        
+        Returns:
+            Number of descriptors indexed for the event
+        """
+        photos, gallery = self._stack_descriptors(photo_collection)
+        metadata = [{k: v for k, v in photo_data.items() if k != 'descriptor'} for photo_data in photos]
+        event_index = EventIndex()
+        event_index.append(gallery, metadata)
+        with self._events_lock:
+            self.events[event_id] = event_index
+        self.logger.info("📦 Indexed %d descriptor(s) for event %s", event_index.size, event_id)
+        return event_index.size
+    
+    def add_to_event(self, event_id: str, photo_id: str, descriptor: Union[List[float], np.ndarray], metadata: Optional[Dict] = None) -> int:
+        """
+        Append one photo descriptor to an event's cached matrix
+        
+        Returns:
+            New number of descriptors in the event
+        """
+        row = decode_descriptor(descriptor).reshape(1, -1)
+        if row.shape[1] != 128:
+            raise ValueError(f"Invalid descriptor: expected 128 dimensions, got {row.shape[1]}")
+        photo = dict(metadata or {})
+        photo['id'] = photo_id
+        with self._events_lock:
+            event_index = self.events.setdefault(event_id, EventIndex())
+            event_index.append(row, [photo])
+            return event_index.size
+    
+    def event_size(self, event_id: str) -> int:
+        event_index = self.events.get(event_id)
+        return event_index.size if event_index is not None else 0
+    
+    def _prefilter_int8(self, probe: np.ndarray, quantized: Tuple[np.ndarray, np.ndarray, np.ndarray], tolerance: float) -> np.ndarray:
+        """Return row indices whose int8-approximated distance is within tolerance plus a safety margin"""
+        codes, scales, sq_norms = quantized
+        probe_codes, probe_scale = quantize_rows(probe.reshape(1, -1))
+        dots = _kernels.dot_i8(codes, probe_codes[0]) * (scales * probe_scale[0])
+        approx_sq = sq_norms + float(probe @ probe) - 2.0 * dots
+        limit = tolerance + self.int8_rerank_margin
+        return np.nonzero(approx_sq <= limit * limit)[0]
+    
+    def _ann_factory(self, rows: int) -> str:
+        return self.ivf_factory if rows >= self.ivf_min_rows else self.hnsw_factory
+    
+    def _ann_candidates(self, event_id: str, event_index: EventIndex, gallery: np.ndarray, probe: np.ndarray, tolerance: float) -> Optional[np.ndarray]:
+        """Return candidate rows from the event's ANN index, or None until one is available"""
+        if faiss is None:
+            return None
+        factory = self._ann_factory(gallery.shape[0])
+        if event_index.ann_factory != factory and not (
+                event_index.ann_failed_factory == factory and time.monotonic() < event_index.ann_retry_at):
+            # First use, or the event outgrew its index type: (re)build in the background, keep serving the old one
+            self._schedule_ann_build(event_id, event_index)
+        if event_index.ann is None:
+            return None
+        
+        limit = tolerance + self.ivf_rerank_margin
+        with event_index.ann_lock:
+            ann = event_index.ann
+            # Rows ingested after the build are appended to the index on demand
+            if ann.ntotal < gallery.shape[0]:
+                ann.add(gallery[ann.ntotal:])
+            _, _, labels = ann.range_search(probe.reshape(1, -1).astype(np.float32), limit * limit)
+        return np.sort(labels[labels < gallery.shape[0]])
+    
+    def _schedule_ann_build(self, event_id: str, event_index: EventIndex) -> None:
+        with event_index.ann_lock:
+            if event_index.ann_building:
+                return
+            event_index.ann_building = True
+        threading.Thread(target=self._build_ann, args=(event_id, event_index), name=f'ann-build-{event_id}', daemon=True).start()
+    
+    def _build_ann(self, event_id: str, event_index: EventIndex) -> None:
+        try:
+            start = time.time()
+            rows = event_index.descriptors[:event_index.size]
+            sample = rows
+            if rows.shape[0] > self.ivf_train_rows:
+                sample = rows[np.random.default_rng(0).choice(rows.shape[0], self.ivf_train_rows, replace=False)]
+            factory = self._ann_factory(rows.shape[0])
+            index = faiss.index_factory(rows.shape[1], factory)
+            if not index.is_trained:
+                index.train(np.ascontiguousarray(sample))
+            index.add(rows)
+            if hasattr(index, 'hnsw'):
+                index.hnsw.efSearch = self.hnsw_ef_search
+            else:
+                faiss.extract_index_ivf(index).nprobe = self.ivf_nprobe
+            with event_index.ann_lock:
+                event_index.ann, event_index.ann_factory = index, factory
+            self.logger.info(f"🗂️ Built {factory} index for event {event_id} ({rows.shape[0]} rows) in {time.time() - start:.1f}s")
+        except Exception as e:
+            event_index.ann_failed_factory = self._ann_factory(event_index.size)
+            event_index.ann_retry_at = time.monotonic() + self.ann_retry_seconds
+            self.logger.error(f"Failed to build ANN index for event {event_id} (retry in {self.ann_retry_seconds:.0f}s): {str(e)}")
+        finally:
+            event_index.ann_building = False
+    
+    def find_matching_photos_in_event(self, user_descriptor: Union[List[float], np.ndarray], event_id: str, tolerance: Optional[float] = None, top_k: Optional[int] = None) -> List[Dict]:
+        """
+        Find matching photos against an event's cached descriptor matrix
+        
+        Args:
+            user_descriptor: User's face encoding
+            event_id: Event whose descriptors were registered via index_event/add_to_event
+            tolerance: Matching tolerance (default: 0.6, lower = stricter)
+            top_k: Optional cap on the number of (best) matches returned
+            
+        Returns:
+            List of matching photos with confidence scores
+        """
+        if not self.initialized:
+            raise Exception("Advanced face recognition service not initialized")
+        
+        try:
+            if tolerance is None:
+                tolerance = self.tolerance
+            
+            with self._events_lock:
+                event_index = self.events.get(event_id)
+                if event_index is None:
+                    raise KeyError(f"No descriptors indexed for event {event_id}")
+                # Rows below size are never rewritten, so the views stay valid after the lock
+                photos, gallery = event_index.photos, event_index.matrix
+                quantized = event_index.quantized
+                sq_norms = quantized[2]
+            
+            self.logger.debug("🎯 Starting face matching for event %s with tolerance: %s", event_id, tolerance)
+            
+            probe = decode_descriptor(user_descriptor)
+            total = gallery.shape[0]
+            use_ann = total >= min(self.hnsw_min_rows, self.ivf_min_rows)
+            keep = self._ann_candidates(event_id, event_index, gallery, probe, tolerance) if use_ann else None
+            if keep is None and total >= self.int8_scan_min_rows:
+                # Cheap int8 scan over every row, exact float32 scoring only for the survivors
+                keep = self._prefilter_int8(probe, quantized, tolerance)
+            if keep is not None:
+                photos = [photos[i] for i in keep]
+                gallery = gallery[keep]
+                sq_norms = sq_norms[keep]
+            matched_photos = self._match_gallery(probe, photos, gallery, tolerance, top_k, sq_norms=sq_norms)
+            
+            self._log_match_summary(total, gallery.shape[0], matched_photos, tolerance)
             return matched_photos
             
         except Exception as e:
@@ -519,29 +1344,67 @@ class AdvancedFaceRecognitionService:
             'photo_data': []
         }
         
-        def _process(idx_url):
-            i, url = idx_url
+        # Downloads are I/O-bound and inference is compute-bound: each frame is decoded and handed
+        # to the micro-batcher as soon as it lands, so the two stages overlap
+        outcomes: Dict[int, Tuple[bool, Optional[List[List[float]]]]] = {}
+        inference = []
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.download_concurrency) as executor:
+            pending = {}
+            to_fetch = []
+            for i, url in enumerate(photo_urls):
+                cached = self._cached_for_url(url)
+                if cached is not None:
+                    outcomes[i] = (True, self._cached_descriptors(cached))
+                else:
+                    to_fetch.append((i, url))
+            
+            if httpx is not None and to_fetch:
+                # One event loop multiplexes every download; only decoding runs on the pool threads
+                def on_downloaded(i: int, downloaded: Optional[Tuple[str, bytes]]) -> None:
+                    pending[executor.submit(self._analyze_download, photo_urls[i], downloaded)] = i
+                asyncio.run(self._download_all(to_fetch, on_downloaded))
+            else:
+                for i, url in to_fetch:
+                    pending[executor.submit(lambda u: self._analyze_download(u, self._download(u)), url)] = i
+            
+            for future in as_completed(pending):
+                i = pending[future]
+                outcome = future.result()
+                if outcome is None:
+                    self.logger.warning("Failed to load photo %d/%d", i + 1, len(photo_urls))
+                    outcomes[i] = (False, None)
+                elif isinstance(outcome, Future):
+                    inference.append((i, outcome))
+                else:
+                    outcomes[i] = (True, self._cached_descriptors(outcome))
+        downloads_done = time.perf_counter()
+        failed = sum(1 for ok, _ in outcomes.values() if not ok)
+        
+        for i, future in inference:
             try:
-                self.logger.info(f"📷 Processing photo {i+1}/{len(photo_urls)}")
-                descriptors = self.get_face_descriptors_from_url(url)
-                return (True, url, descriptors)
+                outcomes[i] = (True, self._cached_descriptors(future.result()))
             except Exception as e:
-                self.logger.warning(f"Failed to process photo {i+1}: {str(e)}")
-                return (False, url, None)
-
-        max_workers = min(8, max(2, (os.cpu_count() or 4)))
-        with ThreadPoolExecutor(max_workers=max_workers) as executor:
-            for ok, url, descriptors in executor.map(_process, list(enumerate(photo_urls))):
-                results['processed'] += 1
-                if ok and descriptors and len(descriptors) > 0:
-                    results['faces_found'] += 1
-                    results['photo_data'].append({
-                        'url': url,
-                        'descriptors': descriptors,
-                        'face_count': len(descriptors)
-                    })
-                elif not ok:
-                    results['failed'] += 1
+                self.logger.warning("Failed to process photo %d: %s", i + 1, e)
+                outcomes[i] = (False, None)
+        finished = time.perf_counter()
+        
+        self.logger.info("⏱️ Batch analysis of %d photos: downloads %.2fs, inference tail %.2fs (%d cached)",
+                         len(photo_urls), downloads_done - start, finished - downloads_done,
+                         len(photo_urls) - len(inference) - failed)
+        
+        for i, url in enumerate(photo_urls):
+            ok, descriptors = outcomes[i]
+            results['processed'] += 1
+            if ok and descriptors and len(descriptors) > 0:
+                results['faces_found'] += 1
+                results['photo_data'].append({
+                    'url': url,
+                    'descriptors': descriptors,
+                    'face_count': len(descriptors)
+                })
+            elif not ok:
+                results['failed'] += 1
         
         return results
 
@@ -0,0 +1,69 @@
+"""
+Gunicorn configuration for the FaceMatch Flask backend
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+One threaded worker by default: event indices live in process memory, and the
+request micro-batcher coalesces the threads' frames into one model call. CPU
+hosts that only serve the stateless endpoints can set FACEMATCH_STATELESS=1 to
+get one process per core instead, since descriptor extraction does not scale
+across threads because of the GIL. A CUDA build of dlib always keeps a single
+worker (one GPU context).
+
+On CPU hosts the dlib models are loaded once in the preloading master and inherited by
+every worker copy-on-write; their weights live in C++ buffers that Python never
+touches, so they stay shared. InsightFace/onnxruntime sessions own thread pools
+that do not survive fork, so that service keeps initializing lazily per worker.
+"""
+
+import os
+import sys
+import multiprocessing
+
+# Gunicorn loads this file by path, so the backend directory is not necessarily on sys.path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from cuda_probe import dlib_uses_cuda  # noqa: E402
+
+
+bind = os.getenv('FACEMATCH_BIND', '0.0.0.0:5000')
+timeout = int(os.getenv('FACEMATCH_TIMEOUT', '120'))
+
+# Event indices (v1 /api/face/ingest, v2 /api/v2/ingest) live in process memory, so a second
+# worker would answer matches from a different, partial index. More than one worker is only
+# allowed with FACEMATCH_STATELESS=1, which switches the event endpoints off.
+stateless = os.getenv('FACEMATCH_STATELESS') == '1'
+threads = int(os.getenv('FACEMATCH_THREADS', '8'))
+
+if dlib_uses_cuda():
+    # One worker has nothing to share copy-on-write, and loading the models in the master could
+    # start CUDA there: the worker imports the app itself so its context is created after fork
+    preload_app = False
+    workers = 1
+else:
+    preload_app = True
+    workers = int(os.getenv('FACEMATCH_WORKERS', str(multiprocessing.cpu_count()) if stateless else '1'))
+    if workers > 1 and not stateless:
+        sys.stderr.write("FACEMATCH_WORKERS > 1 needs FACEMATCH_STATELESS=1 (event indices are per process) - using 1 worker\n")
+        workers = 1
+    elif stateless:
+        threads = int(os.getenv('FACEMATCH_THREADS', '2'))
+
+
+def when_ready(server):
+    """Freeze the preloaded heap so worker GC passes don't write to (and un-share) its pages"""
+    import gc
+    gc.collect()
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    """Make sure every worker has a ready, warmed-up model, even if preloading failed in the master"""
+    if os.getenv('FACEMATCH_PIN_CORES') == '1' and workers > 1 and hasattr(os, 'sched_setaffinity'):
+        # One core per worker keeps its caches warm; respawned workers take the next core round-robin
+        cores = sorted(os.sched_getaffinity(0))
+        os.sched_setaffinity(0, {cores[(worker.age - 1) % len(cores)]})
+    from face_recognition_advanced import advanced_face_service
+    if not advanced_face_service.initialized:
+        advanced_face_service.initialize()
+    # Pay first-inference setup here instead of on the worker's first request
+    advanced_face_service.warmup()
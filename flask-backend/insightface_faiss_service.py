@@ -3,7 +3,7 @@ InsightFace + FAISS service for industry-grade face embedding and fast search.
 
 Notes:
 - Uses ArcFace embeddings (512-d) from InsightFace.
-- Uses cosine similarity via FAISS IndexFlatIP (with L2-normalized vectors).
+- Uses cosine similarity via exact FAISS inner-product search (with L2-normalized vectors).
 - Maintains one in-memory FAISS index per event for simple scoping.
 
 Install deps (CPU):
@@ -15,79 +15,355 @@ GPU (optional):
 """
 
 import io
+import os
+import json
+import queue
 import time
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, List, Optional, Tuple
+from urllib.parse import quote
 
 import numpy as np
 import requests
 
+from micro_batcher import MicroBatcher
+
+try:
+    import fcntl
+except ImportError:  # Windows: saves are not locked against other processes
+    fcntl = None
+
+try:
+    import httpx
+    import importlib.util
+    # HTTP/2 needs the h2 extra (httpx[http2]); without it httpx speaks HTTP/1.1
+    _HTTP2 = importlib.util.find_spec("h2") is not None
+except ImportError:
+    httpx = None
+    _HTTP2 = False
+
+# Optional at import time so the install scripts can load this module before deps exist;
+# initialize() reports whatever is missing.
+try:
+    import cv2  # type: ignore
+except ImportError:
+    cv2 = None
+
+try:
+    import faiss  # type: ignore
+except ImportError:
+    faiss = None
+
 
 logger = logging.getLogger(__name__)
 
 
 def _try_imports():
-    global insightface, faiss
+    global insightface, face_align
     try:
         import insightface  # type: ignore
+        from insightface.utils import face_align  # type: ignore
     except Exception as e:
         raise RuntimeError("insightface is not installed. pip install insightface") from e
+    if faiss is None:
+        raise RuntimeError("faiss-cpu is not installed. pip install faiss-cpu")
+    if cv2 is None:
+        raise RuntimeError("opencv-python is not installed. pip install opencv-python")
+
+
+_turbo = None
+_turbo_rgb = None
+_turbo_checked = False
+
+
+def _turbojpeg():
+    """Lazy PyTurboJPEG handle (libjpeg-turbo SIMD decode straight to RGB), or None if unavailable."""
+    global _turbo, _turbo_rgb, _turbo_checked
+    if not _turbo_checked:
+        _turbo_checked = True
+        try:
+            from turbojpeg import TurboJPEG, TJPF_RGB  # type: ignore
+            _turbo, _turbo_rgb = TurboJPEG(), TJPF_RGB
+        except Exception:
+            # Package missing or libturbojpeg not found on this host
+            _turbo = None
+    return _turbo
+
+
+_nvjpeg = None
+_nvjpeg_checked = False
+
+
+def _nvjpeg_decoder():
+    """(torch, torchvision.io) for nvJPEG decode when FACEMATCH_V2_NVJPEG=1 and CUDA is usable, else None."""
+    global _nvjpeg, _nvjpeg_checked
+    if not _nvjpeg_checked:
+        _nvjpeg_checked = True
+        if os.getenv("FACEMATCH_V2_NVJPEG", "0") == "1":
+            try:
+                import torch  # type: ignore
+                import torchvision.io  # type: ignore
+                if torch.cuda.is_available():
+                    _nvjpeg = (torch, torchvision.io)
+            except Exception:
+                _nvjpeg = None
+    return _nvjpeg
+
+
+def _decode_rgb_gpu(data: bytes, max_size: Optional[Tuple[int, int]]) -> Optional[np.ndarray]:
+    """Decode and shrink a JPEG on the GPU with nvJPEG; only the detector-sized RGB frame comes back to the host."""
+    torch, tvio = _nvjpeg
     try:
-        import faiss  # type: ignore
-    except Exception as e:
-        raise RuntimeError("faiss-cpu is not installed. pip install faiss-cpu") from e
+        encoded = torch.frombuffer(bytearray(data), dtype=torch.uint8)
+        img = tvio.decode_jpeg(encoded, mode=tvio.ImageReadMode.RGB, device="cuda")  # (3, H, W)
+        scale = _fit_scale(img.shape[2], img.shape[1], max_size)
+        if scale < 1.0:
+            size = (max(1, int(round(img.shape[1] * scale))), max(1, int(round(img.shape[2] * scale))))
+            img = torch.nn.functional.interpolate(img.unsqueeze(0).float(), size=size, mode="area")[0]
+            img = img.round_().clamp_(0, 255).to(torch.uint8)
+        return np.ascontiguousarray(img.permute(1, 2, 0).cpu().numpy())
+    except Exception:
+        # CUDA OOM, progressive/CMYK JPEGs nvJPEG rejects, ...: CPU path
+        return None
+
+
+def _fit_scale(width: int, height: int, max_size: Optional[Tuple[int, int]]) -> float:
+    """Downscale factor that fits (width, height) inside max_size (1.0 = leave as is)."""
+    if not max_size or width <= 0 or height <= 0:
+        return 1.0
+    return min(max_size[0] / width, max_size[1] / height, 1.0)
+
+
+def _decode_rgb(data: bytes, max_size: Optional[Tuple[int, int]] = None) -> Optional[np.ndarray]:
+    """Decode encoded image bytes to an RGB uint8 array (None if undecodable).
+
+    With ``max_size`` (w, h) the image is shrunk to fit before any per-pixel
+    color work, so oversize originals never go through a full-resolution pass.
+    """
+    if data[:2] == b"\xff\xd8" and _nvjpeg_decoder() is not None:
+        img = _decode_rgb_gpu(data, max_size)
+        if img is not None:
+            return img
+    turbo = _turbojpeg()
+    if turbo is not None and data[:2] == b"\xff\xd8":
+        try:
+            scaling = None
+            if max_size:
+                width, height = turbo.decode_header(data)[:2]
+                scale = _fit_scale(width, height, max_size)
+                # Largest libjpeg-turbo DCT scale that still covers the target; cv2 does the rest
+                fits = [f for f in turbo.scaling_factors if f[0] / f[1] >= scale and f[0] <= f[1]]
+                if fits:
+                    scaling = min(fits, key=lambda f: f[0] / f[1])
+            img = turbo.decode(data, pixel_format=_turbo_rgb, scaling_factor=scaling)
+            scale = _fit_scale(img.shape[1], img.shape[0], max_size)
+            if scale < 1.0:
+                img = cv2.resize(img, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+            return img
+        except Exception:
+            pass
+    # PNG/WebP, corrupt JPEGs, or no libjpeg-turbo: OpenCV decodes BGR
+    img = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if img is None:
+        return None
+    # Resize first: BGR->RGB then only touches the pixels the detector will see
+    scale = _fit_scale(img.shape[1], img.shape[0], max_size)
+    if scale < 1.0:
+        img = cv2.resize(img, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    return cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+
+
+def _normalized_rows(values) -> np.ndarray:
+    """Caller-supplied embedding(s) as a fresh (n, dim) float32 block, L2-normalized in place by faiss."""
+    rows = np.array(values, dtype=np.float32, ndmin=2, order="C")
+    faiss.normalize_L2(rows)
+    return rows
+
+
+def _normalized_feats(feats: np.ndarray) -> np.ndarray:
+    """ArcFace output normalized in place: it is a fresh float32 array, so no defensive copy is needed."""
+    feats = np.ascontiguousarray(feats, dtype=np.float32)
+    faiss.normalize_L2(feats)
+    return feats
+
+
+def _face_vector(face) -> np.ndarray:
+    """A face's ArcFace embedding as a contiguous unit-length float32 vector."""
+    normed = getattr(face, "normed_embedding", None)
+    if normed is not None:
+        # InsightFace already divided by the norm
+        return np.ascontiguousarray(normed, dtype=np.float32)
+    return _normalized_rows(face.embedding)[0]
+
+
+def _assign_bases(entry: Dict[str, object], new_ids: List[str], start: int) -> None:
+    """Map rows start.. to their base photo (``photo_id#n`` -> ``photo_id``) in ``entry['base_of']``."""
+    base_ids: List[str] = entry["base_ids"]
+    lookup: Dict[str, int] = entry["base_lookup"]
+    base_of: np.ndarray = entry["base_of"]
+    for row, face_id in enumerate(new_ids, start):
+        base_id = face_id.split("#", 1)[0]
+        n = lookup.get(base_id)
+        if n is None:
+            n = lookup[base_id] = len(base_ids)
+            base_ids.append(base_id)
+        base_of[row] = n
 
 
 class InsightFaceFaissService:
     def __init__(self) -> None:
         self.initialized: bool = False
         self.app = None  # InsightFace app
-        # Per-event FAISS indices: event_id -> { 'index': faiss.Index, 'ids': [photo_id], 'vectors': np.ndarray }
+        # Detector input size; downloaded images are shrunk to fit it before color conversion
+        self._det_size: Tuple[int, int] = (640, 640)
+        # Per-event FAISS indices: event_id -> { 'index': faiss.Index (None while flat), 'ids': [photo_id],
+        # 'vectors': preallocated (capacity, dim) float32 buffer, 'size': rows in use, 'capacity': int,
+        # 'kind': 'flat' | 'hnsw' | 'gpu', 'building': bool, 'base_ids': [photo_id without '#n'],
+        # 'base_lookup': {base_id: n}, 'base_of': (capacity,) int32 row -> base_ids position }
         self.event_indices: Dict[str, Dict[str, object]] = {}
+        self._index_lock = threading.Lock()
+        # Events start as an exact scan of their vector buffer and move to HNSW (~log N search) once they reach this size
+        self.hnsw_min_rows = int(os.getenv("FACEMATCH_V2_HNSW_MIN_ROWS", "10000"))
+        self.hnsw_m = 32
+        self.hnsw_ef_construction = 40
+        self.hnsw_ef_search = int(os.getenv("FACEMATCH_V2_HNSW_EF", "16"))
+        # HNSW graphs store 8-bit scalar-quantized vectors (512 B/face instead of 2 KB), trained on the
+        # rows seen at build time; FACEMATCH_V2_SQ8=0 keeps full float32 storage
+        self.hnsw_sq8 = os.getenv("FACEMATCH_V2_SQ8", "1") != "0"
+        # With a GPU build of faiss, flat indices live on device 0 instead (FACEMATCH_V2_FAISS_GPU=0 disables)
+        self.use_faiss_gpu = os.getenv("FACEMATCH_V2_FAISS_GPU", "1") != "0"
+        self._gpu_res = None
+        # Pooled image-download client, created per process on first use (see _http)
+        self._client = None
+        self._client_pid: Optional[int] = None
+        self._client_lock = threading.Lock()
+        # Event indices are written here (debounced after ingest) and reloaded on first use after a
+        # restart, so a redeploy doesn't re-embed every photo; unset keeps indices in memory only
+        self._index_dir = os.getenv("FACEMATCH_V2_INDEX_DIR", "")
+        self.index_save_delay = float(os.getenv("FACEMATCH_V2_INDEX_SAVE_DELAY", "2"))
+        self._pending_saves: Dict[str, threading.Timer] = {}
+        # Frames per batched ArcFace run in ingest_batch
+        self.embed_batch = int(os.getenv("FACEMATCH_V2_EMBED_BATCH", "16"))
+        # Small query batches on big flat events are split along the database axis across this many
+        # threads (faiss only parallelizes flat search over queries, so one query is one core)
+        self.search_threads = int(os.getenv("FACEMATCH_V2_SEARCH_THREADS", str(os.cpu_count() or 1)))
+        self.shard_min_rows = int(os.getenv("FACEMATCH_V2_SHARD_MIN_ROWS", "4096"))
+        self._search_pool: Optional[ThreadPoolExecutor] = None
+        self._search_pool_pid: Optional[int] = None
+        # Concurrent /match queries are coalesced so FAISS scans each event's vectors once per batch
+        self._search_batcher = MicroBatcher(
+            self._search_batch,
+            batch_size=int(os.getenv("FACEMATCH_SEARCH_BATCH", "64")),
+            max_latency=float(os.getenv("FACEMATCH_SEARCH_WINDOW_MS", "5")) / 1000.0,
+            name="faiss-search",
+        )
 
     def initialize(self, det_size: Tuple[int, int] = (640, 640)) -> bool:
         if self.initialized:
             return True
         _try_imports()
-        providers = ["CPUExecutionProvider"]
+        providers: List[object] = ["CPUExecutionProvider"]
+        use_gpu = False
         try:
             # Try GPU provider if available
             import onnxruntime as ort  # type: ignore
             available = [p for p in ort.get_available_providers()]
             if "CUDAExecutionProvider" in available:
-                providers = ["CUDAExecutionProvider", "CPUExecutionProvider"]
+                use_gpu = True
+                providers = [("CUDAExecutionProvider", {"cudnn_conv_algo_search": "HEURISTIC"}), "CPUExecutionProvider"]
+                if "TensorrtExecutionProvider" in available and os.getenv("FACEMATCH_V2_TRT", "1") != "0":
+                    # FP16 engines are built on first run (~a minute) and cached on disk for restarts
+                    cache_path = os.getenv("FACEMATCH_V2_TRT_CACHE", os.path.join(os.path.expanduser("~"), ".cache", "facematch", "trt"))
+                    os.makedirs(cache_path, exist_ok=True)
+                    providers.insert(0, ("TensorrtExecutionProvider", {
+                        "trt_fp16_enable": True,
+                        "trt_engine_cache_enable": True,
+                        "trt_engine_cache_path": cache_path,
+                    }))
         except Exception:
             pass
 
         self.app = insightface.app.FaceAnalysis(name="buffalo_l", providers=providers)
-        self.app.prepare(ctx_id=0 if "CUDAExecutionProvider" in providers else -1, det_size=det_size)
+        self.app.prepare(ctx_id=0 if use_gpu else -1, det_size=det_size)
+        self._det_size = (int(det_size[0]), int(det_size[1]))
+        if not use_gpu and os.getenv("FACEMATCH_V2_INT8", "0") == "1":
+            self._use_int8_recognition()
         self.initialized = True
         logger.info("InsightFace initialized with providers=%s det_size=%s", providers, det_size)
         return True
 
+    def _use_int8_recognition(self) -> None:
+        """Swap the ArcFace session for a dynamically INT8-quantized copy (CPU only).
+
+        The quantized model is written next to the original once and reused on restarts. INT8
+        weights shift embeddings slightly, so an event should not mix vectors from both models.
+        """
+        rec = self.app.models.get("recognition") if self.app is not None else None
+        if rec is None:
+            return
+        try:
+            import onnxruntime as ort  # type: ignore
+            from onnxruntime.quantization import QuantType, quantize_dynamic  # type: ignore
+            int8_path = os.path.splitext(rec.model_file)[0] + "_int8.onnx"
+            if not os.path.exists(int8_path):
+                tmp_path = int8_path + ".tmp"
+                quantize_dynamic(rec.model_file, tmp_path, weight_type=QuantType.QInt8)
+                os.replace(tmp_path, int8_path)
+            opts = ort.SessionOptions()
+            opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+            workers = max(1, int(os.getenv("FACEMATCH_WORKERS", "1")))
+            opts.intra_op_num_threads = max(1, (os.cpu_count() or 1) // workers)
+            rec.session = ort.InferenceSession(int8_path, sess_options=opts, providers=["CPUExecutionProvider"])
+            logger.info("ArcFace running INT8 from %s", int8_path)
+        except Exception as e:
+            logger.warning("INT8 ArcFace unavailable, keeping FP32: %s", e)
+
+    def _http(self):
+        """Keep-alive client shared by download threads; recreated after fork so workers don't share sockets.
+
+        With httpx (HTTP/2 when h2 is installed) concurrent Cloudinary fetches multiplex over one
+        TLS connection; otherwise a pooled requests.Session reuses connections per thread.
+        """
+        pid = os.getpid()
+        if self._client is None or self._client_pid != pid:
+            with self._client_lock:
+                if self._client is None or self._client_pid != pid:
+                    headers = {"User-Agent": "FaceMatch/1.0"}
+                    if httpx is not None:
+                        client = httpx.Client(
+                            http2=_HTTP2,
+                            timeout=20.0,
+                            headers=headers,
+                            follow_redirects=True,
+                            limits=httpx.Limits(max_connections=128, max_keepalive_connections=64),
+                        )
+                    else:
+                        client = requests.Session()
+                        adapter = requests.adapters.HTTPAdapter(pool_connections=64, pool_maxsize=64)
+                        client.mount("http://", adapter)
+                        client.mount("https://", adapter)
+                        client.headers.update(headers)
+                    self._client, self._client_pid = client, pid
+        return self._client
+
     def _download_image(self, image_url: str) -> Optional[np.ndarray]:
-        headers = {"User-Agent": "FaceMatch/1.0"}
         # Add Cloudinary downscale if missing transforms
         optimized = image_url
         try:
             if 'res.cloudinary.com' in image_url and '/image/upload/' in image_url and ('/w_' not in image_url):
-                optimized = image_url.replace('/image/upload/', '/image/upload/w_640,q_75,c_limit,fl_lossy/')
+                det_w, det_h = self._det_size
+                optimized = image_url.replace('/image/upload/', f'/image/upload/w_{det_w},h_{det_h},q_75,c_limit,fl_lossy/')
         except Exception:
             pass
         try:
-            r = requests.get(optimized, timeout=20, headers=headers)
+            r = self._http().get(optimized, timeout=20)
             r.raise_for_status()
         except Exception as e:
             logger.warning("Image download failed: %s", e)
             return None
-        import cv2  # lazy
-        import numpy as np
-        arr = np.frombuffer(r.content, dtype=np.uint8)
-        img = cv2.imdecode(arr, cv2.IMREAD_COLOR)
-        if img is None:
-            return None
-        img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-        return img
+        return _decode_rgb(r.content, self._det_size)
 
     def compute_embedding_from_url(self, image_url: str) -> Optional[np.ndarray]:
         if not self.initialized:
@@ -95,17 +371,52 @@ class InsightFaceFaissService:
         img = self._download_image(image_url)
         if img is None:
             return None
+        return self._best_face_embedding(img)
+
+    def _embeddings_from_image(self, img: np.ndarray) -> Optional[List[np.ndarray]]:
         faces = self.app.get(img)
         if not faces:
             return None
-        # Use most confident face
-        face = max(faces, key=lambda f: getattr(f, 'det_score', 0.0))
-        emb = face.normed_embedding if hasattr(face, 'normed_embedding') else face.embedding
-        vec = np.array(emb, dtype=np.float32)
-        # Ensure normalized for cosine
-        norm = np.linalg.norm(vec) + 1e-8
-        vec = vec / norm
-        return vec
+        return [_face_vector(f) for f in faces]
+
+    def _best_face_embedding(self, img: np.ndarray) -> Optional[np.ndarray]:
+        """Embedding of the most confident face only: one argmax over the detector's scores, one ArcFace crop."""
+        bboxes, kpss = self.app.det_model.detect(img, max_num=0, metric="default")
+        if bboxes is None or len(bboxes) == 0 or kpss is None:
+            return None
+        best = int(np.argmax(bboxes[:, 4]))
+        rec_model = self.app.models["recognition"]
+        crop = face_align.norm_crop(img, landmark=kpss[best], image_size=rec_model.input_size[0])
+        return _normalized_feats(rec_model.get_feat(crop))[0]
+
+    def compute_embeddings_batch(self, imgs: List[np.ndarray]) -> List[Optional[List[np.ndarray]]]:
+        """Embeddings for all faces in several images, with one ArcFace run for the whole batch.
+
+        Detection still runs per image (the bundled SCRFD export takes one frame at a time),
+        but every aligned crop goes through the recognizer in a single session.run, and the
+        landmark/gender-age heads that ``app.get`` would also run are skipped.
+        """
+        if not self.initialized:
+            self.initialize()
+        det_model = self.app.det_model
+        rec_model = self.app.models["recognition"]
+        crops: List[np.ndarray] = []
+        counts: List[int] = []
+        for img in imgs:
+            _, kpss = det_model.detect(img, max_num=0, metric="default")
+            n = 0 if kpss is None else len(kpss)
+            for kps in (kpss if n else []):
+                crops.append(face_align.norm_crop(img, landmark=kps, image_size=rec_model.input_size[0]))
+            counts.append(n)
+        if not crops:
+            return [None] * len(imgs)
+        feats = _normalized_feats(rec_model.get_feat(crops))
+        results: List[Optional[List[np.ndarray]]] = []
+        offset = 0
+        for n in counts:
+            results.append([feats[i] for i in range(offset, offset + n)] if n else None)
+            offset += n
+        return results
 
     def compute_embeddings_from_url(self, image_url: str) -> Optional[List[np.ndarray]]:
         """Return embeddings for all detected faces in the image URL."""
@@ -114,17 +425,7 @@ class InsightFaceFaissService:
         img = self._download_image(image_url)
         if img is None:
             return None
-        faces = self.app.get(img)
-        if not faces:
-            return None
-        embeddings: List[np.ndarray] = []
-        for f in faces:
-            emb = f.normed_embedding if hasattr(f, 'normed_embedding') else f.embedding
-            vec = np.array(emb, dtype=np.float32)
-            norm = np.linalg.norm(vec) + 1e-8
-            vec = vec / norm
-            embeddings.append(vec)
-        return embeddings
+        return self._embeddings_from_image(img)
 
     def get_face_embedding(self, image_file) -> Optional[np.ndarray]:
         """Compute ArcFace embedding from an uploaded file-like object."""
@@ -137,35 +438,177 @@ class InsightFaceFaissService:
                 image_file.seek(0)
             except Exception:
                 pass
-            import cv2  # lazy
-            import numpy as np
-            arr = np.frombuffer(data, dtype=np.uint8)
-            img_bgr = cv2.imdecode(arr, cv2.IMREAD_COLOR)
-            if img_bgr is None:
+            img = _decode_rgb(data)
+            if img is None:
                 return None
-            img = cv2.cvtColor(img_bgr, cv2.COLOR_BGR2RGB)
 
-            faces = self.app.get(img)
-            if not faces:
-                return None
-            face = max(faces, key=lambda f: getattr(f, 'det_score', 0.0))
-            emb = face.normed_embedding if hasattr(face, 'normed_embedding') else face.embedding
-            vec = np.array(emb, dtype=np.float32)
-            norm = np.linalg.norm(vec) + 1e-8
-            vec = vec / norm
-            return vec
+            return self._best_face_embedding(img)
         except Exception:
             return None
 
+    def _gpu_resources(self):
+        """Shared StandardGpuResources, or None when faiss has no usable GPU."""
+        if self._gpu_res is None and self.use_faiss_gpu:
+            try:
+                if faiss.get_num_gpus() > 0:
+                    self._gpu_res = faiss.StandardGpuResources()
+            except Exception:
+                # CPU-only faiss builds have no GPU bindings
+                pass
+            if self._gpu_res is None:
+                self.use_faiss_gpu = False
+        return self._gpu_res
+
+    def _new_entry(self, vectors: np.ndarray, ids: List[str], index=None) -> Dict[str, object]:
+        """Index entry over a copy of ``vectors``.
+
+        Without a prebuilt ``index`` the entry is flat: the buffer itself is searched with faiss.knn,
+        so no IndexFlatIP keeps a second copy of every vector. With a GPU the flat index lives on device.
+        """
+        size, dim = vectors.shape
+        capacity = max(1024, size)
+        buffer = np.empty((capacity, dim), dtype=np.float32)
+        buffer[:size] = vectors
+        kind = "hnsw"
+        base_of = np.empty(capacity, dtype=np.int32)
+        if index is None:
+            kind = "flat"
+            gpu_res = self._gpu_resources()
+            if gpu_res is not None:
+                # One cuBLAS GEMM per query batch; host arrays are copied in by faiss on add/search
+                index = faiss.index_cpu_to_gpu(gpu_res, 0, faiss.IndexFlatIP(dim))
+                kind = "gpu"
+                if size:
+                    index.add(buffer[:size])
+        entry = {
+            "index": index,
+            "ids": ids,
+            "vectors": buffer,
+            "size": size,
+            "capacity": capacity,
+            "kind": kind,
+            "building": False,
+            "base_ids": [],
+            "base_lookup": {},
+            "base_of": base_of,
+        }
+        _assign_bases(entry, ids, 0)
+        return entry
+
     def _get_or_create_index(self, event_id: str, dim: int = 512):
-        import faiss  # type: ignore
         entry = self.event_indices.get(event_id)
         if entry is None:
-            index = faiss.IndexFlatIP(dim)
-            self.event_indices[event_id] = {"index": index, "ids": [], "vectors": np.zeros((0, dim), dtype=np.float32)}
-            entry = self.event_indices[event_id]
+            entry = self._load_index(event_id)
+            if entry is None:
+                entry = self._new_entry(np.empty((0, dim), dtype=np.float32), [])
+            self.event_indices[event_id] = entry
+        return entry
+
+    def _index_paths(self, event_id: str) -> Tuple[str, str, str]:
+        """(vectors .npy, ids .json, faiss .idx) files for an event; event ids are quoted so they can't escape the dir."""
+        base = os.path.join(self._index_dir, quote(event_id, safe=""))
+        return base + ".npy", base + ".ids.json", base + ".idx"
+
+    def _load_index(self, event_id: str) -> Optional[Dict[str, object]]:
+        """Rebuild an event's entry from FACEMATCH_V2_INDEX_DIR, or None if it was never saved."""
+        if not self._index_dir:
+            return None
+        vectors_path, ids_path, index_path = self._index_paths(event_id)
+        if not (os.path.exists(vectors_path) and os.path.exists(ids_path)):
+            return None
+        try:
+            start = time.time()
+            with open(ids_path, "r", encoding="utf-8") as f:
+                ids = json.load(f)
+            vectors = np.load(vectors_path, mmap_mode="r")
+            size = min(len(ids), vectors.shape[0])
+            index = None
+            if os.path.exists(index_path):
+                # Memory-mapped: the graph pages in lazily and is shared through the page cache
+                index = faiss.read_index(index_path, faiss.IO_FLAG_MMAP)
+                if index.ntotal != size:
+                    # Written by an older save than the vectors; fall back to a fresh flat index
+                    index = None
+            entry = self._new_entry(vectors[:size], ids[:size], index=index)
+            logger.info("Loaded event %s from disk (%d vectors, %s) in %.2fs", event_id, size, entry["kind"], time.time() - start)
+        except Exception as e:
+            logger.error("Loading saved index for event %s failed: %s", event_id, e)
+            return None
+        if entry["kind"] == "flat" and size >= self.hnsw_min_rows:
+            entry["building"] = True
+            threading.Thread(target=self._build_hnsw, args=(event_id, entry), name=f"hnsw-build-{event_id}", daemon=True).start()
         return entry
 
+    def _schedule_save(self, event_id: str) -> None:
+        """Coalesce saves: one write per event per FACEMATCH_V2_INDEX_SAVE_DELAY seconds of ingest."""
+        if not self._index_dir:
+            return
+        with self._index_lock:
+            if event_id in self._pending_saves:
+                return
+            timer = threading.Timer(self.index_save_delay, self._save_index, args=(event_id,))
+            timer.daemon = True
+            self._pending_saves[event_id] = timer
+        timer.start()
+
+    def _save_index(self, event_id: str) -> None:
+        try:
+            with self._index_lock:
+                self._pending_saves.pop(event_id, None)
+                entry = self.event_indices.get(event_id)
+                if entry is None:
+                    return
+                # Rows below size are never rewritten, so the views stay valid after the lock
+                size = entry["size"]
+                vectors = entry["vectors"][:size]
+                ids = list(entry["ids"])
+                # Flat/GPU indices are rebuilt from the vectors on load; only graphs are worth storing
+                blob = faiss.serialize_index(entry["index"]) if entry["kind"] == "hnsw" else None
+            os.makedirs(self._index_dir, exist_ok=True)
+            vectors_path, ids_path, index_path = self._index_paths(event_id)
+            # Other processes may share the directory: save under an exclusive lock and keep the rows
+            # they wrote that this process hasn't seen, instead of overwriting them with a partial view
+            with open(vectors_path[:-len(".npy")] + ".lock", "a") as lock:
+                if fcntl is not None:
+                    fcntl.flock(lock, fcntl.LOCK_EX)
+                foreign_vectors, foreign_ids = self._foreign_rows(event_id, set(ids))
+                if foreign_ids:
+                    vectors = np.vstack([vectors, foreign_vectors])
+                    ids = ids + foreign_ids
+                    blob = None  # the graph doesn't cover the merged rows; it is rebuilt on load
+                # Write-then-rename so a crash mid-save never leaves a truncated file behind
+                np.save(vectors_path + ".tmp.npy", vectors)
+                os.replace(vectors_path + ".tmp.npy", vectors_path)
+                with open(ids_path + ".tmp", "w", encoding="utf-8") as f:
+                    json.dump(ids, f)
+                os.replace(ids_path + ".tmp", ids_path)
+                if blob is not None:
+                    blob.tofile(index_path + ".tmp")
+                    os.replace(index_path + ".tmp", index_path)
+                elif os.path.exists(index_path):
+                    os.remove(index_path)
+            logger.info("Saved event %s (%d vectors) to %s", event_id, len(ids), self._index_dir)
+            if foreign_ids:
+                # Pick up the other writers' rows here too (this schedules one more, no-op-merge save)
+                logger.info("Merged %d row(s) of event %s saved by another process", len(foreign_ids), event_id)
+                self._add_vectors(event_id, [foreign_vectors], foreign_ids)
+        except Exception as e:
+            logger.error("Saving index for event %s failed: %s", event_id, e)
+
+    def _foreign_rows(self, event_id: str, known_ids: set) -> Tuple[Optional[np.ndarray], List[str]]:
+        """Rows in the saved files whose ids this process doesn't hold; call with the event's file lock."""
+        vectors_path, ids_path, _ = self._index_paths(event_id)
+        if not (os.path.exists(vectors_path) and os.path.exists(ids_path)):
+            return None, []
+        with open(ids_path, "r", encoding="utf-8") as f:
+            saved_ids = json.load(f)
+        rows = [i for i, photo_id in enumerate(saved_ids) if photo_id not in known_ids]
+        if not rows:
+            return None, []
+        saved = np.load(vectors_path, mmap_mode="r")
+        rows = [i for i in rows if i < saved.shape[0]]
+        return np.ascontiguousarray(saved[rows], dtype=np.float32), [saved_ids[i] for i in rows]
+
     def ingest(self, event_id: str, photo_id: str, image_url: Optional[str] = None, embedding: Optional[List[float]] = None) -> bool:
         if not self.initialized:
             self.initialize()
@@ -179,62 +622,254 @@ class InsightFaceFaissService:
             if not vecs:
                 return False
             for i, v in enumerate(vecs):
-                vectors_to_add.append(v.reshape(1, -1))
+                vectors_to_add.append(v)
                 ids_to_add.append(f"{photo_id}#{i}")
         else:
-            vec = np.asarray(embedding, dtype=np.float32)
-            norm = np.linalg.norm(vec) + 1e-8
-            vec = vec / norm
-            vectors_to_add.append(vec.reshape(1, -1))
+            vectors_to_add.append(_normalized_rows(embedding))
             ids_to_add.append(photo_id)
 
-        # Initialize index based on dimension
-        entry = self._get_or_create_index(event_id, dim=vectors_to_add[0].shape[1])
-        index = entry["index"]
-        ids: List[str] = entry["ids"]
-        vectors: np.ndarray = entry["vectors"]
+        self._add_vectors(event_id, vectors_to_add, ids_to_add)
+        return True
 
-        # Append all vectors
-        for v, pid in zip(vectors_to_add, ids_to_add):
-            vectors = np.vstack([vectors, v])
-            index.add(v)
-            ids.append(pid)
+    def _add_vectors(self, event_id: str, vectors_to_add: List[np.ndarray], ids_to_add: List[str]) -> None:
+        """Append (dim,) / (n, dim) vectors and their ids to an event index in one FAISS add."""
+        # Stacking is the only copy: inputs are already unit-length float32 rows
+        block = np.vstack(vectors_to_add).astype(np.float32, copy=False)
+        k = block.shape[0]
+        with self._index_lock:
+            # Initialize index based on dimension
+            entry = self._get_or_create_index(event_id, dim=block.shape[1])
+            index = entry["index"]
+            ids: List[str] = entry["ids"]
+            if index is not None:
+                index.add(block)
+            # Double the buffer on overflow so ingestion copies are amortized O(1) per row
+            size = entry["size"]
+            if size + k > entry["capacity"]:
+                grown = np.empty((max(entry["capacity"] * 2, size + k), block.shape[1]), dtype=np.float32)
+                grown[:size] = entry["vectors"][:size]
+                grown_base = np.empty(grown.shape[0], dtype=np.int32)
+                grown_base[:size] = entry["base_of"][:size]
+                entry["vectors"], entry["base_of"], entry["capacity"] = grown, grown_base, grown.shape[0]
+            entry["vectors"][size:size + k] = block
+            _assign_bases(entry, ids_to_add, size)
+            entry["size"] = size + k
+            ids.extend(ids_to_add)
+            size = len(ids)
+            if entry["kind"] == "flat" and size >= self.hnsw_min_rows and not entry["building"]:
+                entry["building"] = True
+                threading.Thread(target=self._build_hnsw, args=(event_id, entry), name=f"hnsw-build-{event_id}", daemon=True).start()
+        self._schedule_save(event_id)
+        logger.info("Ingested %d face(s) into event %s (index size=%d)", len(ids_to_add), event_id, size)
 
-        entry["vectors"] = vectors
-        logger.info("Ingested %d face(s) for photo %s into event %s (index size=%d)", len(ids_to_add), photo_id, event_id, len(ids))
-        return True
+    def _build_hnsw(self, event_id: str, entry: Dict[str, object]) -> None:
+        """Build an HNSW index from the event's buffer off the request path, then swap it in."""
+        try:
+            start = time.time()
+            with self._index_lock:
+                # Rows below size are never rewritten, so the snapshot stays valid after the lock
+                built = entry["size"]
+                snapshot = entry["vectors"][:built]
+            if self.hnsw_sq8:
+                index = faiss.IndexHNSWSQ(snapshot.shape[1], faiss.ScalarQuantizer.QT_8bit, self.hnsw_m,
+                                          faiss.METRIC_INNER_PRODUCT)
+                # Per-dimension ranges from the first hnsw_min_rows+ faces; the float buffer stays for retraining
+                index.train(snapshot)
+            else:
+                index = faiss.IndexHNSWFlat(snapshot.shape[1], self.hnsw_m, faiss.METRIC_INNER_PRODUCT)
+            index.hnsw.efConstruction = self.hnsw_ef_construction
+            index.hnsw.efSearch = self.hnsw_ef_search
+            index.add(snapshot)
+            with self._index_lock:
+                # Catch up on anything ingested while the graph was being built
+                if entry["size"] > built:
+                    index.add(entry["vectors"][built:entry["size"]])
+                entry["index"], entry["kind"] = index, "hnsw"
+            logger.info("Moved event %s to HNSW%s (%d vectors) in %.1fs", event_id,
+                        ",SQ8" if self.hnsw_sq8 else "", index.ntotal, time.time() - start)
+            self._schedule_save(event_id)
+        except Exception as e:
+            logger.error("HNSW build for event %s failed: %s", event_id, e)
+        finally:
+            entry["building"] = False
+
+    def ingest_batch(self, event_id: str, photos: List[Dict[str, object]], max_workers: int = 16) -> Dict[str, bool]:
+        """Ingest several photos at once: concurrent downloads, one FAISS add for the whole batch.
+
+        Each photo is a dict with ``photo_id`` and either ``image_url`` or ``embedding``.
+        Returns a per-photo success map.
+        """
+        if not self.initialized:
+            self.initialize()
+        results: Dict[str, bool] = {}
+        vectors_to_add: List[np.ndarray] = []
+        ids_to_add: List[str] = []
+        to_download: List[Tuple[str, str]] = []
+        for photo in photos:
+            photo_id = photo.get("photo_id")
+            if not photo_id:
+                continue
+            if photo.get("embedding") is not None:
+                vectors_to_add.append(_normalized_rows(photo["embedding"]))
+                ids_to_add.append(photo_id)
+                results[photo_id] = True
+            elif photo.get("image_url"):
+                to_download.append((photo_id, photo["image_url"]))
+            else:
+                results[photo_id] = False
+
+        if to_download:
+            # Downloads run in the pool while this thread embeds images in arrival order (ONNX Runtime
+            # sessions are safe to share between concurrent requests). The bounded queue caps decoded
+            # frames in memory, so it must be drained to the end: fetch threads block on a full queue.
+            frames: "queue.Queue[Tuple[str, Optional[np.ndarray]]]" = queue.Queue(maxsize=32)
+
+            def fetch(photo_id: str, image_url: str) -> None:
+                img = None
+                try:
+                    img = self._download_image(image_url)
+                except Exception as e:
+                    logger.warning("Image decode failed: %s", e)
+                finally:
+                    frames.put((photo_id, img))
+
+            with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(to_download)))) as executor:
+                for photo_id, image_url in to_download:
+                    executor.submit(fetch, photo_id, image_url)
+                remaining = len(to_download)
+                while remaining:
+                    # Block for one frame, then take whatever else has already arrived (up to embed_batch)
+                    arrived = [frames.get()]
+                    while len(arrived) < min(self.embed_batch, remaining):
+                        try:
+                            arrived.append(frames.get_nowait())
+                        except queue.Empty:
+                            break
+                    remaining -= len(arrived)
+                    decoded = [(photo_id, img) for photo_id, img in arrived if img is not None]
+                    for photo_id, img in arrived:
+                        if img is None:
+                            results[photo_id] = False
+                    try:
+                        batch_vecs = self.compute_embeddings_batch([img for _, img in decoded]) if decoded else []
+                    except Exception as e:
+                        logger.warning("Embedding batch of %d failed: %s", len(decoded), e)
+                        batch_vecs = [None] * len(decoded)
+                    for (photo_id, _), vecs in zip(decoded, batch_vecs):
+                        results[photo_id] = bool(vecs)
+                        for i, v in enumerate(vecs or []):
+                            vectors_to_add.append(v)
+                            ids_to_add.append(f"{photo_id}#{i}")
+
+        if vectors_to_add:
+            self._add_vectors(event_id, vectors_to_add, ids_to_add)
+        return results
 
     def match(self, event_id: str, query_embedding: List[float], top_k: int = 20, threshold: float = 0.35):
+        """Match a caller-supplied embedding (any sequence, any scale); converts and normalizes, then match_fast."""
         if not self.initialized:
             self.initialize()
+        return self.match_fast(event_id, _normalized_rows(query_embedding)[0], top_k=top_k, threshold=threshold)
+
+    def match_fast(self, event_id: str, q: np.ndarray, top_k: int = 20, threshold: float = 0.35):
+        """Match an already unit-length, C-contiguous float32 (dim,) or (1, dim) query without conversion.
+
+        For internal callers holding InsightFace/_face_vector output; ``match`` is the list-accepting wrapper.
+        """
+        if q.dtype != np.float32 or not q.flags["C_CONTIGUOUS"] or q.ndim not in (1, 2):
+            raise ValueError("match_fast needs a C-contiguous float32 (dim,) or (1, dim) vector")
+        if q.ndim == 2:
+            q = q[0]
         entry = self.event_indices.get(event_id)
+        if entry is None and self._index_dir:
+            # First query for this event since a restart
+            with self._index_lock:
+                entry = self.event_indices.get(event_id) or self._load_index(event_id)
+                if entry is not None:
+                    self.event_indices[event_id] = entry
         if entry is None or len(entry["ids"]) == 0:
             return []
-        index = entry["index"]
+        if q.shape[0] != entry["vectors"].shape[1]:
+            raise ValueError(f"Query has {q.shape[0]} dimensions, event {event_id} stores {entry['vectors'].shape[1]}")
         ids: List[str] = entry["ids"]
-        q = np.asarray(query_embedding, dtype=np.float32)
-        q = q / (np.linalg.norm(q) + 1e-8)
+        D, I = self._search_batcher.submit((event_id, q, min(top_k, len(ids)))).result()
+        # cosine similarity in [-1,1]; keep above threshold
+        keep = (I >= 0) & (D >= threshold)
+        if not keep.any():
+            return []
+        # Group by base photo_id (before '#') and keep max score per photo, all in NumPy
+        bases, slot = np.unique(entry["base_of"][I[keep]], return_inverse=True)
+        best = np.full(len(bases), -np.inf, dtype=np.float32)
+        np.maximum.at(best, slot, D[keep])
+        base_ids: List[str] = entry["base_ids"]
+        # Sort by score desc
+        order = np.argsort(-best, kind="stable")
+        return [{"id": base_ids[b], "score": sc} for b, sc in zip(bases[order].tolist(), best[order].tolist())]
+
 
-        D, I = index.search(q.reshape(1, -1), min(top_k, len(ids)))
-        results = []
-        for score, idx in zip(D[0].tolist(), I[0].tolist()):
-            if idx < 0:
+    def _search_batch(self, items: List[Tuple[str, np.ndarray, int]]) -> List[object]:
+        """Run coalesced (event_id, query, k) items as one multi-query FAISS search per event."""
+        results: List[object] = [None] * len(items)
+        by_event: Dict[str, List[int]] = {}
+        for n, (event_id, _, _) in enumerate(items):
+            by_event.setdefault(event_id, []).append(n)
+        for event_id, members in by_event.items():
+            # A failing event group only fails its own callers, not the other events coalesced with it
+            try:
+                queries = np.stack([items[n][1] for n in members]).astype(np.float32, copy=False)
+                max_k = max(items[n][2] for n in members)
+                # Held so a concurrent ingest can't resize the index mid-search
+                with self._index_lock:
+                    entry = self.event_indices.get(event_id)
+                    if entry is None:
+                        D = np.zeros((len(members), 0), dtype=np.float32)
+                        I = np.zeros((len(members), 0), dtype=np.int64)
+                    elif entry["kind"] == "flat":
+                        D, I = self._flat_search(entry, queries, max_k)
+                    else:
+                        D, I = entry["index"].search(queries, max_k)
+            except Exception as e:
+                logger.error("Search for event %s failed: %s", event_id, e)
+                for n in members:
+                    results[n] = e
                 continue
-            # cosine similarity in [-1,1]; keep above threshold
-            if score >= threshold:
-                results.append({
-                    "id": ids[idx],
-                    "score": float(score),
-                })
-        # Group by base photo_id (before '#') and keep max score per photo
-        grouped: Dict[str, float] = {}
-        for r in results:
-            base_id = r["id"].split("#", 1)[0]
-            grouped[base_id] = max(grouped.get(base_id, 0.0), r["score"])
-        deduped = [{"id": pid, "score": sc} for pid, sc in grouped.items()]
-        # Sort by score desc
-        deduped.sort(key=lambda x: x["score"], reverse=True)
-        return deduped
+            for row, n in enumerate(members):
+                k = items[n][2]
+                results[n] = (D[row, :k], I[row, :k])
+        return results
+
+
+    def _flat_search(self, entry: Dict[str, object], queries: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Exact inner-product top-k straight over a flat event's vector buffer."""
+        # Above ~20 queries faiss switches to a multi-threaded BLAS GEMM on its own
+        if self.search_threads > 1 and len(queries) < 20 and entry["size"] >= self.shard_min_rows:
+            return self._sharded_search(entry, queries, k)
+        return faiss.knn(queries, entry["vectors"][:entry["size"]], k, metric=faiss.METRIC_INNER_PRODUCT)
+
+    def _sharded_search(self, entry: Dict[str, object], queries: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Exact inner-product top-k over the event's buffer, one contiguous slice per thread, merged."""
+        pid = os.getpid()
+        if self._search_pool is None or self._search_pool_pid != pid:
+            self._search_pool = ThreadPoolExecutor(max_workers=self.search_threads, thread_name_prefix="faiss-shard")
+            self._search_pool_pid = pid
+        size = entry["size"]
+        vectors = entry["vectors"]
+        bounds = np.linspace(0, size, self.search_threads + 1, dtype=np.int64)
+        slices = [(int(lo), int(hi)) for lo, hi in zip(bounds[:-1], bounds[1:]) if hi > lo]
+
+        def search_slice(lo: int, hi: int) -> Tuple[np.ndarray, np.ndarray]:
+            # faiss releases the GIL, so the slices stream from memory in parallel
+            D, I = faiss.knn(queries, vectors[lo:hi], min(k, hi - lo), metric=faiss.METRIC_INNER_PRODUCT)
+            return D, I + lo
+
+        parts = list(self._search_pool.map(lambda bounds: search_slice(*bounds), slices))
+        D_all = np.concatenate([D for D, _ in parts], axis=1)
+        I_all = np.concatenate([I for _, I in parts], axis=1)
+        # Global top-k per query: partition, then order just the k winners
+        top = np.argpartition(-D_all, k - 1, axis=1)[:, :k]
+        top_D = np.take_along_axis(D_all, top, axis=1)
+        order = np.argsort(-top_D, axis=1, kind="stable")
+        return np.take_along_axis(top_D, order, axis=1), np.take_along_axis(np.take_along_axis(I_all, top, axis=1), order, axis=1)
 
 
 # Singleton service
@@ -0,0 +1,101 @@
+"""
+Micro-batching helper for model inference.
+
+Request threads submit single items and block on a Future; one background
+worker drains the queue for a short window (or until the batch is full) and
+runs the batch function once, then fans the results back out. This keeps the
+model running at batch size > 1 under concurrent load while adding at most
+``max_latency`` seconds to an idle request.
+"""
+
+import os
+import queue
+import logging
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, List, Optional, Tuple
+
+
+logger = logging.getLogger(__name__)
+
+
+class MicroBatcher:
+    """Coalesce concurrent single-item calls into batched calls.
+
+    ``predict_function`` receives a list of items and must return a list of
+    results of the same length. A result that is an ``Exception`` instance is
+    raised in the caller of that item only.
+    """
+
+    def __init__(self, predict_function: Callable[[List[Any]], List[Any]],
+                 batch_size: int = 16, max_latency: float = 0.02,
+                 name: str = "micro-batcher") -> None:
+        self.predict_function = predict_function
+        self.batch_size = max(1, int(batch_size))
+        self.max_latency = max(0.0, float(max_latency))
+        self.name = name
+        self._queue: "queue.Queue[Tuple[Any, Future]]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._worker: Optional[threading.Thread] = None
+        self._worker_pid: Optional[int] = None
+
+    def submit(self, item: Any) -> Future:
+        """Queue one item and return a Future for its result."""
+        self._ensure_worker()
+        future: Future = Future()
+        self._queue.put((item, future))
+        return future
+
+    def predict(self, items: List[Any]) -> List[Any]:
+        """Submit items and block until all results are available."""
+        futures = [self.submit(item) for item in items]
+        return [f.result() for f in futures]
+
+    def _ensure_worker(self) -> None:
+        # Threads do not survive fork, so (re)start lazily in each process.
+        pid = os.getpid()
+        if self._worker is not None and self._worker_pid == pid and self._worker.is_alive():
+            return
+        with self._lock:
+            if self._worker is not None and self._worker_pid == pid and self._worker.is_alive():
+                return
+            if self._worker_pid != pid:
+                self._queue = queue.Queue()
+            self._worker = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._worker_pid = pid
+            self._worker.start()
+
+    def _collect(self) -> List[Tuple[Any, Future]]:
+        pending = [self._queue.get()]
+        # Keep filling until the batch is full or the window since the first item closes
+        deadline = time.monotonic() + self.max_latency
+        while len(pending) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0:
+                    pending.append(self._queue.get(timeout=remaining))
+                else:
+                    pending.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return pending
+
+    def _run(self) -> None:
+        while True:
+            pending = self._collect()
+            items = [item for item, _ in pending]
+            try:
+                results = self.predict_function(items)
+                if len(results) != len(items):
+                    raise RuntimeError(f"{self.name}: batch returned {len(results)} results for {len(items)} items")
+            except Exception as e:
+                logger.error("%s batch of %d failed: %s", self.name, len(items), e)
+                for _, future in pending:
+                    future.set_exception(e)
+                continue
+            for (_, future), result in zip(pending, results):
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
@@ -11,10 +11,13 @@ Usage:
 """
 
 import argparse
+import asyncio
 import json
 import time
 import logging
+from collections import OrderedDict
 from typing import Dict, List, Optional
+import httpx
 import requests
 import os
 from datetime import datetime
@@ -26,11 +29,78 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+class RecentIds:
+    """Bounded set of recently ingested photo ids (least recently seen evicted first).
+
+    With a checkpoint path every add is appended to that file (O(1) per photo), so a
+    restarted worker skips what it already ingested. The file is rewritten to the tracked
+    ``maxsize`` ids on load and whenever it grows past twice that many lines.
+    """
+
+    def __init__(self, maxsize: int = 200_000, checkpoint_path: Optional[str] = None):
+        self.maxsize = max(1, int(maxsize))
+        self._ids: "OrderedDict[str, None]" = OrderedDict()
+        self._path = checkpoint_path
+        self._log = None
+        self._logged = 0  # Lines in the checkpoint file
+        if checkpoint_path:
+            self._load(checkpoint_path)
+            self._compact()
+            logger.info("Loaded %d processed photo ids from %s", len(self._ids), checkpoint_path)
+
+    def _load(self, path: str) -> None:
+        if not os.path.exists(path):
+            return
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                photo_id = line.rstrip('\n')
+                if photo_id:
+                    self._remember(photo_id)
+
+    def _compact(self) -> None:
+        """Rewrite the checkpoint with only what is still tracked, then keep appending to it"""
+        if self._log is not None:
+            self._log.close()
+        tmp = self._path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.writelines(f"{photo_id}\n" for photo_id in self._ids)
+        os.replace(tmp, self._path)
+        self._log = open(self._path, 'a', encoding='utf-8')
+        self._logged = len(self._ids)
+
+    def _remember(self, photo_id: str) -> None:
+        self._ids[photo_id] = None
+        self._ids.move_to_end(photo_id)
+        if len(self._ids) > self.maxsize:
+            self._ids.popitem(last=False)
+
+    def __contains__(self, photo_id: str) -> bool:
+        return photo_id in self._ids
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def add(self, photo_id: str) -> None:
+        self._remember(photo_id)
+        if self._log is not None:
+            self._log.write(f"{photo_id}\n")
+            self._logged += 1
+            if self._logged > 2 * self.maxsize:
+                self._compact()
+
+    def flush(self) -> None:
+        if self._log is not None:
+            self._log.flush()
+
+
 class PhotoWorker:
-    def __init__(self, flask_base_url: str = "http://localhost:5000"):
+    def __init__(self, flask_base_url: str = "http://localhost:5000", checkpoint_path: Optional[str] = None,
+                 max_tracked: int = 200_000, concurrency: int = 4):
         self.flask_base_url = flask_base_url
+        self.concurrency = max(1, int(concurrency))  # Batch requests in flight at once
         self.session = requests.Session()
-        self.processed_photos = set()  # Track processed photos to avoid duplicates
+        # Track processed photos to avoid duplicates; bounded, optionally checkpointed to disk
+        self.processed_photos = RecentIds(max_tracked, checkpoint_path)
         
     def health_check(self) -> bool:
         """Check if Flask backend is running and InsightFace is ready."""
@@ -45,6 +115,26 @@ class PhotoWorker:
             logger.error(f"❌ Cannot connect to Flask backend: {e}")
             return False
     
+    async def ingest_batch(self, client: httpx.AsyncClient, event_id: str, photos: List[Dict]) -> Dict[str, bool]:
+        """Ingest one event's photos with a single /api/v2/ingest/batch request. Returns per-photo success."""
+        try:
+            response = await client.post(
+                f"{self.flask_base_url}/api/v2/ingest/batch",
+                json={"event_id": event_id, "photos": photos},
+                timeout=300  # Whole batch is downloaded and embedded server-side
+            )
+            
+            if response.status_code == 200:
+                result = response.json()
+                return {pid: bool(ok) for pid, ok in result.get('results', {}).items()}
+            else:
+                logger.warning("Failed to ingest batch of %d for event %s: %s", len(photos), event_id, response.status_code)
+                return {}
+                
+        except Exception as e:
+            logger.warning("Error ingesting batch of %d for event %s: %s", len(photos), event_id, e)
+            return {}
+    
     def ingest_photo(self, event_id: str, photo_id: str, image_url: str) -> bool:
         """Ingest a single photo into the FAISS index."""
         try:
@@ -62,11 +152,11 @@ class PhotoWorker:
                 result = response.json()
                 return result.get('success', False)
             else:
-                logger.warning(f"Failed to ingest {photo_id}: {response.status_code}")
+                logger.warning("Failed to ingest %s: %s", photo_id, response.status_code)
                 return False
                 
         except Exception as e:
-            logger.warning(f"Error ingesting {photo_id}: {e}")
+            logger.warning("Error ingesting %s: %s", photo_id, e)
             return False
     
     def get_new_photos(self, firebase_config_path: str, last_check: Optional[datetime] = None) -> List[Dict]:
@@ -95,8 +185,8 @@ class PhotoWorker:
         logger.info("⚠️ Firebase integration not implemented - no new photos found")
         return []
     
-    def process_photos(self, photos: List[Dict]) -> Dict:
-        """Process a batch of photos."""
+    def process_photos(self, photos: List[Dict], batch_size: int = 64) -> Dict:
+        """Process a batch of photos, grouped per event into /api/v2/ingest/batch requests."""
         results = {
             'total': len(photos),
             'success': 0,
@@ -104,35 +194,59 @@ class PhotoWorker:
             'skipped': 0
         }
         
+        pending: Dict[str, List[Dict]] = {}
         for photo in photos:
             photo_id = photo.get('id')
             event_id = photo.get('event_id') or photo.get('project_passcode')
             image_url = photo.get('cloudinaryUrl') or photo.get('cloudinary_url')
             
             if not photo_id or not event_id or not image_url:
-                logger.warning(f"Skipping photo {photo_id}: missing required fields")
+                logger.warning("Skipping photo %s: missing required fields", photo_id)
                 results['skipped'] += 1
                 continue
             
             if photo_id in self.processed_photos:
-                logger.info(f"⏭️ Photo {photo_id} already processed")
+                logger.debug("⏭️ Photo %s already processed", photo_id)
                 results['skipped'] += 1
                 continue
             
-            logger.info(f"🔄 Processing photo {photo_id} for event {event_id}")
-            
-            success = self.ingest_photo(event_id, photo_id, image_url)
-            
-            if success:
-                results['success'] += 1
-                self.processed_photos.add(photo_id)
-                logger.info(f"✅ Successfully ingested {photo_id}")
-            else:
-                results['failed'] += 1
-                logger.warning(f"❌ Failed to ingest {photo_id}")
+            logger.debug("🔄 Processing photo %s for event %s", photo_id, event_id)
+            pending.setdefault(event_id, []).append({"photo_id": photo_id, "image_url": image_url})
+        
+        # The server downloads each batch concurrently and adds it to the event index in one go;
+        # several batches are in flight at once so its downloads and model batching overlap
+        chunks = [
+            (event_id, event_photos[start:start + batch_size])
+            for event_id, event_photos in pending.items()
+            for start in range(0, len(event_photos), batch_size)
+        ]
+        outcomes = asyncio.run(self._ingest_chunks(chunks)) if chunks else []
+        for (event_id, chunk), outcome in zip(chunks, outcomes):
+            for photo in chunk:
+                photo_id = photo["photo_id"]
+                if outcome.get(photo_id):
+                    results['success'] += 1
+                    self.processed_photos.add(photo_id)
+                    logger.debug("✅ Successfully ingested %s", photo_id)
+                else:
+                    results['failed'] += 1
+                    logger.warning("❌ Failed to ingest %s", photo_id)
+        self.processed_photos.flush()
         
         return results
     
+    async def _ingest_chunks(self, chunks: List[tuple]) -> List[Dict[str, bool]]:
+        """Post (event_id, photos) chunks concurrently, at most self.concurrency at a time, in input order."""
+        semaphore = asyncio.Semaphore(self.concurrency)
+        limits = httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency)
+        
+        async with httpx.AsyncClient(limits=limits) as client:
+            async def process_chunk(event_id: str, chunk: List[Dict]) -> Dict[str, bool]:
+                async with semaphore:
+                    return await self.ingest_batch(client, event_id, chunk)
+            
+            return await asyncio.gather(*(process_chunk(event_id, chunk) for event_id, chunk in chunks))
+    
     def run_once(self, firebase_config_path: str) -> Dict:
         """Run the worker once to process any new photos."""
         if not self.health_check():
@@ -180,11 +294,15 @@ def main():
     parser.add_argument('--flask-url', default='http://localhost:5000', help='Flask backend URL')
     parser.add_argument('--poll-interval', type=int, default=60, help='Polling interval in seconds')
     parser.add_argument('--once', action='store_true', help='Run once and exit (don\'t poll)')
+    parser.add_argument('--checkpoint', help='File recording ingested photo ids, so restarts skip them')
+    parser.add_argument('--max-tracked', type=int, default=200_000, help='Most recent photo ids remembered for de-duplication')
+    parser.add_argument('--concurrency', type=int, default=4, help='Batch ingest requests in flight at once')
     
     args = parser.parse_args()
     
     # Initialize worker
-    worker = PhotoWorker(args.flask_url)
+    worker = PhotoWorker(args.flask_url, checkpoint_path=args.checkpoint, max_tracked=args.max_tracked,
+                         concurrency=args.concurrency)
     
     if args.once:
         # Run once
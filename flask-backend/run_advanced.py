@@ -6,11 +6,29 @@ Starts the industrial-grade face recognition backend
 
 import sys
 import os
-import subprocess
+import shutil
+import logging
+import platform
+import statistics
+import time
+from importlib.util import find_spec
 
-def check_dependencies():
-    """Check if advanced face recognition dependencies are installed"""
-    print("🔍 Checking advanced face recognition dependencies...")
+# Own handler instead of basicConfig, so app_advanced still configures the root logger in
+# the in-process server. FACEMATCH_QUIET=1 keeps only warnings and failures (benchmarks/CI).
+log = logging.getLogger('facematch.runner')
+_handler = logging.StreamHandler(sys.stdout)
+_handler.setFormatter(logging.Formatter('%(message)s'))
+log.addHandler(_handler)
+log.propagate = False
+log.setLevel(logging.WARNING if os.getenv('FACEMATCH_QUIET') == '1' else os.getenv('FACEMATCH_LOG', 'INFO').upper())
+
+def check_dependencies(import_modules=True):
+    """Check if advanced face recognition dependencies are installed
+
+    import_modules=False only locates them (find_spec): used before handing off to Gunicorn,
+    whose workers import everything again anyway.
+    """
+    log.info("🔍 Checking advanced face recognition dependencies...")
     
     required_modules = [
         'face_recognition',
@@ -26,24 +44,142 @@ def check_dependencies():
     
     for module in required_modules:
         try:
-            __import__(module)
-            print(f"✅ {module}")
+            if import_modules:
+                __import__(module)
+            elif find_spec(module) is None:
+                raise ImportError(module)
+            log.info(f"✅ {module}")
         except ImportError:
-            print(f"❌ {module} - MISSING")
+            log.error(f"❌ {module} - MISSING")
             missing_modules.append(module)
     
     if missing_modules:
-        print(f"\n❌ Missing dependencies: {', '.join(missing_modules)}")
-        print("💡 Run the installation script first:")
-        print("   python install_advanced.py")
+        log.error(f"\n❌ Missing dependencies: {', '.join(missing_modules)}")
+        log.error("💡 Run the installation script first:")
+        log.error("   python install_advanced.py")
         return False
     
-    print("✅ All dependencies are installed!")
+    log.info("✅ All dependencies are installed!")
     return True
 
+def check_build_flags():
+    """Warn loudly about dlib/OpenCV builds that silently run face detection ~10x slower"""
+    log.info("\n🔧 Checking dlib/OpenCV build flags...")
+    
+    import dlib
+    import cv2
+    
+    strict = os.getenv('FACEMATCH_STRICT') == '1'
+    x86 = platform.machine().lower() in ('x86_64', 'amd64', 'i386', 'i686')
+    problems = []
+    
+    if getattr(dlib, 'DLIB_USE_CUDA', False):
+        log.info(f"✅ dlib CUDA (CUDA_VISIBLE_DEVICES={os.environ.get('CUDA_VISIBLE_DEVICES')})")
+        try:
+            # Relative to CUDA_VISIBLE_DEVICES, so the pinned card is always 0
+            dlib.cuda.set_device(0)
+        except Exception as e:
+            log.warning(f"⚠️  Could not select CUDA device 0: {e}")
+    else:
+        log.info("ℹ️  dlib built without CUDA - using the HOG detector on CPU")
+    
+    # SSE4/AVX only exist on x86; dlib's wheel reports ARM builds via USE_NEON_INSTRUCTIONS instead
+    if x86:
+        avx = getattr(dlib, 'USE_AVX_INSTRUCTIONS', None)
+        if avx is False:
+            problems.append("dlib built without AVX/SSE4 - expect ~10x slower face detection (see dlib#713)")
+        elif avx:
+            log.info("✅ dlib AVX")
+        else:
+            log.info("ℹ️  dlib does not report its SIMD flags - cannot verify AVX support")
+        
+        if 'Intel IPP:' not in cv2.getBuildInformation():
+            log.warning("⚠️  OpenCV built without Intel IPP - resizing and color conversion will be slower")
+    
+    if getattr(dlib, 'DLIB_USE_BLAS', True) is False:
+        problems.append("dlib built without BLAS - face encoding will be slow")
+    
+    for problem in problems:
+        log.warning(f"⚠️  {problem}")
+    
+    if problems and strict:
+        log.error("❌ FACEMATCH_STRICT=1 - refusing to start on an unoptimized build")
+        log.error("💡 Rebuild dlib from source on this machine (it enables AVX when the CPU has it):")
+        log.error("   pip install --force-reinstall --no-cache-dir dlib")
+        return False
+    
+    return True
+
+def limit_blas_threads(workers):
+    """Split the cores between worker processes for OpenBLAS/MKL/OpenMP (read when the worker loads them)
+
+    Left alone, every worker's BLAS pool spans all cores: N workers x N threads thrash.
+    Values already in the environment win.
+    """
+    threads = max(1, (os.cpu_count() or 1) // max(1, workers))
+    for var in ('OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS', 'OMP_NUM_THREADS', 'VECLIB_MAXIMUM_THREADS'):
+        os.environ.setdefault(var, str(threads))
+    log.info(f"🧵 BLAS/OpenMP threads per worker: {os.environ['OMP_NUM_THREADS']} ({workers} workers)")
+
+def _free_gpu_mb():
+    """Free memory on the pinned GPU via NVML, or None when pynvml/the driver isn't available"""
+    try:
+        import pynvml
+        pynvml.nvmlInit()
+        try:
+            # With CUDA_DEVICE_ORDER=PCI_BUS_ID, CUDA ordinals match NVML indices
+            device = os.environ.get('CUDA_VISIBLE_DEVICES', '0').split(',')[0].strip()
+            if device.isdigit():
+                handle = pynvml.nvmlDeviceGetHandleByIndex(int(device))
+            else:
+                handle = pynvml.nvmlDeviceGetHandleByUUID(device)
+            return pynvml.nvmlDeviceGetMemoryInfo(handle).free // (1024 * 1024)
+        finally:
+            pynvml.nvmlShutdown()
+    except Exception:
+        return None
+
+def _free_ram_mb():
+    try:
+        import psutil
+        return psutil.virtual_memory().available // (1024 * 1024)
+    except ImportError:
+        return None
+
+def choose_detector():
+    """Fall back to HOG before launch when the CNN detector would not fit in free memory
+
+    dlib's CNN detector fails with bad_alloc mid-request on small hosts; a crash-restart loop
+    is worse than the faster, less thorough HOG model. An explicit FACEMATCH_DETECTION_MODEL
+    is kept and only warned about.
+    """
+    import dlib
+    
+    explicit = os.environ.get('FACEMATCH_DETECTION_MODEL')
+    cuda = getattr(dlib, 'DLIB_USE_CUDA', False)
+    if explicit is None and not cuda:
+        return  # the service already defaults to HOG without CUDA
+    if explicit is not None and explicit != 'cnn':
+        return
+    
+    if cuda:
+        free_mb, need_mb, where = _free_gpu_mb(), 2048, 'GPU memory'
+    else:
+        free_mb, need_mb, where = _free_ram_mb(), 6144, 'RAM'
+    if free_mb is None:
+        log.info(f"ℹ️  Cannot read free {where} - keeping the CNN detector")
+        return
+    if free_mb >= need_mb:
+        log.info(f"✅ CNN detector: {free_mb}MB free {where}")
+    elif explicit:
+        log.warning(f"⚠️  Only {free_mb}MB free {where} (CNN wants {need_mb}MB) - FACEMATCH_DETECTION_MODEL=cnn may run out of memory")
+    else:
+        os.environ['FACEMATCH_DETECTION_MODEL'] = 'hog'
+        log.warning(f"⚠️  Only {free_mb}MB free {where} (CNN wants {need_mb}MB) - using the HOG detector")
+
 def test_face_recognition():
     """Test if face recognition is working"""
-    print("\n🧪 Testing face recognition functionality...")
+    log.info("\n🧪 Testing face recognition functionality...")
     
     try:
         import face_recognition
@@ -53,60 +189,171 @@ def test_face_recognition():
         test_image = np.zeros((100, 100, 3), dtype=np.uint8)
         face_locations = face_recognition.face_locations(test_image)
         
-        print("✅ Face recognition is functional!")
+        log.info("✅ Face recognition is functional!")
         return True
         
     except Exception as e:
-        print(f"❌ Face recognition test failed: {str(e)}")
-        print("💡 Try reinstalling face_recognition:")
-        print("   pip install --upgrade face-recognition")
+        log.error(f"❌ Face recognition test failed: {str(e)}")
+        log.error("💡 Try reinstalling face_recognition:")
+        log.error("   pip install --upgrade face-recognition")
+        return False
+
+def benchmark_detection():
+    """Time the configured detector on a 640x480 frame; a misbuilt dlib shows up here, not in /health"""
+    import dlib
+    import face_recognition
+    import numpy as np
+    
+    cuda = getattr(dlib, 'DLIB_USE_CUDA', False) and dlib.cuda.get_num_devices() > 0
+    model = os.environ.get('FACEMATCH_DETECTION_MODEL') or ('cnn' if cuda else 'hog')
+    budget = float(os.getenv('FACEMATCH_DETECT_BUDGET_S', '0.2'))
+    frame = np.random.default_rng(0).integers(0, 256, (480, 640, 3), dtype=np.uint8)
+    
+    # The first call pays one-time setup (CNN weights onto the GPU, cuDNN autotuning)
+    face_recognition.face_locations(frame, number_of_times_to_upsample=0, model=model)
+    samples = []
+    for _ in range(3):
+        start = time.perf_counter()
+        face_recognition.face_locations(frame, number_of_times_to_upsample=0, model=model)
+        samples.append(time.perf_counter() - start)
+    median = statistics.median(samples)
+    
+    if median <= budget:
+        log.info(f"✅ {model.upper()} detection: {median * 1000:.0f}ms per 640x480 frame")
+        return True
+    
+    log.warning(f"⚠️  {model.upper()} detection takes {median * 1000:.0f}ms per 640x480 frame "
+                f"(budget {budget * 1000:.0f}ms, FACEMATCH_DETECT_BUDGET_S)")
+    if model == 'cnn' and not cuda:
+        log.warning("💡 The CNN detector is meant for CUDA builds; use FACEMATCH_DETECTION_MODEL=hog on CPU")
+    else:
+        log.warning("💡 Probable cause: dlib built without AVX/CUDA - rebuild it with -DUSE_AVX_INSTRUCTIONS=1")
+    if os.getenv('FACEMATCH_STRICT') == '1':
+        log.error("❌ FACEMATCH_STRICT=1 - refusing to start with detection over budget")
         return False
+    return True
+
+def log_serving_config(max_image_size, batch_size, max_latency):
+    log.info(f"📐 Detector input: long side capped at {max_image_size}px (FACEMATCH_MAX_IMAGE_SIZE)")
+    log.info(f"📦 Request batching: up to {batch_size} images per {max_latency * 1000:.0f}ms window "
+             "(FACEMATCH_MAX_BATCH / FACEMATCH_BATCH_WINDOW_MS)")
+
+def pin_gpu():
+    """Expose exactly one GPU, in PCI bus order, before anything touches CUDA
+
+    dlib, onnxruntime and faiss all use device 0 of what they can see, so this keeps them on
+    the same card; it is inherited by the Gunicorn workers. FACEMATCH_GPU picks the card.
+    """
+    os.environ.setdefault('CUDA_DEVICE_ORDER', 'PCI_BUS_ID')
+    os.environ.setdefault('CUDA_VISIBLE_DEVICES', os.environ.get('FACEMATCH_GPU', '0'))
 
 def main():
-    print("🚀 Starting Advanced FaceMatch Backend")
-    print("=" * 50)
-    print("🎯 INDUSTRIAL-GRADE AI FACE RECOGNITION")
-    print("=" * 50)
+    log.info("🚀 Starting Advanced FaceMatch Backend")
+    log.info("=" * 50)
+    log.info("🎯 INDUSTRIAL-GRADE AI FACE RECOGNITION")
+    log.info("=" * 50)
     
     # Check if we're in the right directory
     if not os.path.exists('app_advanced.py'):
-        print("❌ app_advanced.py not found!")
-        print("💡 Make sure you're in the flask-backend directory")
+        log.error("❌ app_advanced.py not found!")
+        log.error("💡 Make sure you're in the flask-backend directory")
         return False
     
+    # Must run before the dependency check imports dlib
+    pin_gpu()
+    
+    # Gunicorn (gunicorn.conf.py) is the default server; FACEMATCH_SERVER=flask keeps the
+    # single-process dev server. Exec'd workers re-import everything, so the checks before the
+    # hand-off stay light: modules are only located, and dlib itself is loaded just for its flags
+    server = os.getenv('FACEMATCH_SERVER', 'gunicorn')
+    gunicorn = shutil.which('gunicorn') if os.name != 'nt' and server != 'flask' else None
+    
     # Check dependencies
-    if not check_dependencies():
+    if not check_dependencies(import_modules=gunicorn is None):
         return False
     
-    # Test face recognition
-    if not test_face_recognition():
+    # Catch slow dlib builds before they show up as slow requests
+    if not check_build_flags():
         return False
     
-    print("\n🔥 Starting Advanced Flask Server...")
-    print("📡 Server will be available at: http://localhost:5000")
-    print("🏥 Health check: http://localhost:5000/health")
-    print("\n🎯 Advanced Features:")
-    print("   • Deep Learning CNN Models")
-    print("   • 128-Dimensional Face Encodings")
-    print("   • Industrial-Level Accuracy")
-    print("   • Multi-Scale Face Detection")
-    print("   • Advanced Image Preprocessing")
-    print("\n" + "=" * 50)
+    # Decide before the app (or the Gunicorn workers, via the environment) reads the setting
+    choose_detector()
+    
+    # The smoke test and benchmark load the face models and run the detector: worth it in the
+    # process that then serves, but before an exec only when FACEMATCH_STRICT=1 asks to fail fast
+    if gunicorn is None or os.getenv('FACEMATCH_STRICT') == '1':
+        if not test_face_recognition():
+            return False
+        
+        # Catch builds that import fine but detect ~10x slower than they should
+        if not benchmark_detection():
+            return False
+    else:
+        log.info("\nℹ️  Skipping the detector self-test - each Gunicorn worker warms up its models after fork")
+    
+    log.info("\n🔥 Starting Advanced Flask Server...")
+    log.info("📡 Server will be available at: http://localhost:5000")
+    log.info("🏥 Health check: http://localhost:5000/health")
+    log.info("\n🎯 Advanced Features:")
+    log.info("   • Deep Learning CNN Models")
+    log.info("   • 128-Dimensional Face Encodings")
+    log.info("   • Industrial-Level Accuracy")
+    log.info("   • Multi-Scale Face Detection")
+    log.info("   • Batched CNN Detection (batch_face_locations)")
+    log.info("   • Advanced Image Preprocessing")
+    log.info("\n" + "=" * 50)
+    
+    if gunicorn:
+        argv = [gunicorn, '-c', 'gunicorn.conf.py', 'wsgi:app']
+        if server == 'uvicorn':
+            # Same Gunicorn master, but uvicorn workers (uvloop + httptools when installed) accept and
+            # parse connections; Flask runs on a2wsgi's pool of FACEMATCH_THREADS threads per worker
+            if find_spec('uvicorn') and find_spec('a2wsgi'):
+                argv[3:] = ['-k', 'uvicorn.workers.UvicornWorker', 'wsgi:asgi_app']
+            else:
+                log.warning("⚠️  FACEMATCH_SERVER=uvicorn needs uvicorn and a2wsgi - using threaded workers")
+        # Same worker count gunicorn.conf.py will choose; the exec'd workers inherit the limits
+        # (several only for stateless CPU deployments, see gunicorn.conf.py)
+        from cuda_probe import dlib_uses_cuda
+        cuda = dlib_uses_cuda()
+        stateless = os.getenv('FACEMATCH_STATELESS') == '1'
+        limit_blas_threads(int(os.getenv('FACEMATCH_WORKERS', str(os.cpu_count() or 1))) if stateless and not cuda else 1)
+        # The workers read the same variables (face_recognition_advanced defaults)
+        log_serving_config(int(os.getenv('FACEMATCH_MAX_IMAGE_SIZE', '640')),
+                           int(os.getenv('FACEMATCH_MAX_BATCH', '16')),
+                           float(os.getenv('FACEMATCH_BATCH_WINDOW_MS', '15')) / 1000.0)
+        log.info(f"🦄 Serving with Gunicorn: {' '.join(['gunicorn'] + argv[1:])}")
+        sys.stdout.flush()
+        try:
+            # exec replaces this interpreter, so the modules imported by the checks aren't kept resident
+            os.execv(gunicorn, argv)
+        except OSError as e:
+            log.warning(f"⚠️  Could not start Gunicorn ({e}) - falling back to the Flask server")
     
     try:
-        # Start the advanced Flask application
-        subprocess.run([sys.executable, 'app_advanced.py'], check=True)
+        # Serve from this interpreter: unless this is the fallback from a failed exec, the dependency
+        # check and face_recognition test above already paid for the imports and dlib/CUDA start-up
+        from app_advanced import app, face_service, DEBUG_MODE
         
-    except KeyboardInterrupt:
-        print("\n🛑 Server stopped by user")
+        if face_service.initialize():
+            face_service.warmup()
+            log.info("✅ Advanced Face Recognition initialized successfully!")
+            batcher = face_service._batcher
+            log_serving_config(face_service.MAX_IMAGE_SIZE, batcher.batch_size, batcher.max_latency)
+        else:
+            log.error("❌ Advanced Face Recognition initialization failed!")
+            log.warning("⚠️  Server will start but face recognition won't work")
+        
+        # The debug reloader would re-exec this script and load the face models twice
+        app.run(debug=DEBUG_MODE, use_reloader=False, host='0.0.0.0', port=5000, threaded=True)
         return True
         
-    except subprocess.CalledProcessError as e:
-        print(f"\n❌ Server failed to start: {e}")
-        return False
+    except KeyboardInterrupt:
+        log.info("\n🛑 Server stopped by user")
+        return True
         
     except Exception as e:
-        print(f"\n❌ Unexpected error: {e}")
+        log.error(f"\n❌ Server failed to start: {e}")
         return False
 
 if __name__ == "__main__":
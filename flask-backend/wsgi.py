@@ -0,0 +1,33 @@
+"""
+WSGI entry point for production serving with Gunicorn
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+With preload_app enabled (see gunicorn.conf.py) this module is imported once in
+the master, so the face models are loaded before workers fork and are shared
+copy-on-write instead of being loaded per worker.
+
+``asgi_app`` wraps the same app for uvicorn workers (FACEMATCH_SERVER=uvicorn):
+
+    gunicorn -c gunicorn.conf.py -k uvicorn.workers.UvicornWorker wsgi:asgi_app
+
+a2wsgi runs each request on a pool of FACEMATCH_THREADS threads, like the gthread
+worker does; asgiref's WsgiToAsgi would serialize them on one thread per worker.
+"""
+
+import os
+import logging
+from app_advanced import app, face_service
+
+try:
+    from a2wsgi import WSGIMiddleware
+except ImportError:
+    WSGIMiddleware = None
+
+logger = logging.getLogger(__name__)
+
+if not face_service.initialized and not face_service.initialize():
+    logger.error("❌ Advanced Face Recognition initialization failed - face endpoints will return errors")
+
+# Same thread count as gunicorn.conf.py, so concurrent requests still reach the micro-batcher together
+asgi_app = WSGIMiddleware(app, workers=int(os.getenv('FACEMATCH_THREADS', '8'))) if WSGIMiddleware is not None else None